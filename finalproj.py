@@ -2,16 +2,76 @@ from bs4 import BeautifulSoup
 from openpyxl import load_workbook
 import plotly.graph_objs as go
 import plotly.figure_factory as ff
+import numpy as np
 import requests
 import json
 import webbrowser
 import csv
 import sqlite3
 import time
+import os
+import datetime
+import random
+import threading
+import math
+import zipfile
+import tempfile
+import functools
+import http.server
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 CACHE_FILENAME = "covid_cache.json"
 CACHE_DICT = {}
 DB_NAME = "covid_usdaers.sqlite"
+CORRELATION_CACHE = {}
+COVID_OUTCOMES = ["Cases Per 100k", "Deaths Per 100k"]
+NEIGHBOR_INDEX = {}
+RANK_METRICS = {
+    "Cases": "Cases",
+    "Deaths": "Deaths",
+    "Growth": "Growth",
+    "Cases Per 100k": "Cases * 100000.0 / (SELECT CountyPopulation FROM SocioeconomicCounties WHERE Fips = CountyTotals.Fips)",
+    "Deaths Per 100k": "Deaths * 100000.0 / (SELECT CountyPopulation FROM SocioeconomicCounties WHERE Fips = CountyTotals.Fips)"
+}
+GROWTH_DAYS = 7
+USE_SHARDS = False
+SHARD_DIR = "covid_shards"
+SHARD_WORKERS = 8
+FIPS_EXCEPTIONS = ["New York City", "Kansas City"]
+FIPS_BOROUGHS = {("New York", "New York City"): [36005, 36047, 36061, 36081, 36085]}
+REFRESH_INTERVAL = 600
+REFRESH_JITTER = 60
+REFRESH_RETRY = 30
+REFRESH_MAX_BACKOFF = 3600
+REFRESH_METRICS = {"Refreshes": 0, "Failures": 0, "Consecutive Failures": 0, "Last Latency": None, "Last Refresh": None}
+REFRESH_STOP = threading.Event()
+NPR_ERRORS = (requests.exceptions.RequestException, AttributeError, IndexError, TypeError, ValueError)
+ERS_DATA_DIR = "socioeconomic_data"
+COUNTY_ERS_FILE = "socioeconomic_data/CountyData.csv"
+DOWNLOAD_METADATA = "downloads.json"
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_TIMEOUT = 30
+REQUEST_TIMEOUT = 30
+DOWNLOAD_CHUNK = 65536
+ERS_METRICS = [
+    {"Name": "Population", "Column": "Population", "Type": "INTEGER", "File": "socioeconomic_data/PopulationReport.xlsx", "Sheet": "PopulationReport", "Names": "A6:A56", "Values": "E6:E56", "Source": "Population", "Transform": None},
+    {"Name": "Median Household Income", "Column": "MedianIncome", "Type": "INTEGER", "File": "socioeconomic_data/UnemploymentReportPercent.xlsx", "Sheet": "UnemploymentReport", "Names": "B4:B54", "Values": "L4:L54", "Source": "Unemployment", "Transform": "income_to_int"},
+    {"Name": "Poverty Rate", "Column": "PovertyRate", "Type": "DECIMAL", "File": "socioeconomic_data/PovertyReportPercent.xlsx", "Sheet": "PovertyReport", "Names": "A7:A57", "Values": "E7:E57", "Source": "Poverty", "Transform": None},
+    {"Name": "Unemployment Rate", "Column": "UnemploymentRate", "Type": "DECIMAL", "File": "socioeconomic_data/UnemploymentReportPercent.xlsx", "Sheet": "UnemploymentReport", "Names": "B4:B54", "Values": "K4:K54", "Source": "Unemployment", "Transform": None},
+    {"Name": "Completed HS Only Rate", "Column": "CompHSOnlyRate", "Type": "DECIMAL", "File": "socioeconomic_data/EducationReportHSOnly.xlsx", "Sheet": "EducationReport", "Names": "A6:A56", "Values": "F6:F56", "Source": "Education", "Transform": "convert_to_percent"},
+    {"Name": "College Completion Rate", "Column": "CompCollRate", "Type": "DECIMAL", "File": "socioeconomic_data/EducationReportCompColl.xlsx", "Sheet": "EducationReport", "Names": "A6:A56", "Values": "F6:F56", "Source": "Education", "Transform": "convert_to_percent"}
+]
+SOCIOECON_METRICS = {m["Name"]: m["Column"] for m in ERS_METRICS if m["Name"] != "Population"}
+GEO_DATA_DIR = "geo_data"
+GEO_CACHE_DIR = "geo_data/cache"
+GEO_SCALE = 1000
+ZOOM_TOLERANCES = {"nation": 0.05, "state": 0.01}
+GEOMETRY_CACHE = {}
+SKETCH_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_QUANTILES = {"Median": 0.5, "P90": 0.9, "P99": 0.99}
+VALIDATION_RULES = ["Row Length", "Fips Format", "Date Format", "Date Order", "Count Format", "Negative Count", "Cumulative Decrease"]
+FLAGGED_RULES = ["Cumulative Decrease"]
 
 def build_county_url_dict():
     ''' Scrapes USDA ERS county-level datasets webpage and creates a dictionary for each dataset and its corresponding URL.
@@ -27,7 +87,7 @@ def build_county_url_dict():
     '''
 
     url = "https://www.ers.usda.gov/data-products/county-level-data-sets/"
-    response = requests.get(url)
+    response = requests.get(url, timeout=REQUEST_TIMEOUT)
     soup = BeautifulSoup(response.text, "html.parser")
 
     make_request_with_cache(url, soup.prettify())
@@ -48,6 +108,272 @@ def build_county_url_dict():
 
     return data_dict
 
+def ers_download_urls(url_dict):
+    ''' Matches the datasets found by build_county_url_dict() to the workbooks in ERS_METRICS, using each metric's "Source" (a word from the dataset name). A dataset report can only fill one workbook, so workbooks that share a dataset with a different workbook (the two education workbooks) are left out and must be given their own URL. Only 3 of the 5 workbooks get a URL this way.
+
+    The URLs are the USDA ERS report pages. download_file() only keeps a download that is a real workbook, so while a report page serves HTML rather than the workbook, its file is reported "Failed" and the workbook already on disk is kept.
+    
+    PARAMETERS
+    ----------
+    url_dict: dict
+        Dataset names and their URLs.
+
+    RETURNS
+    -------
+    dict:
+        Workbook file names (e.g. "PovertyReportPercent.xlsx") and the URL to download each from.
+    '''
+
+    files_by_source = {}
+    for m in ERS_METRICS:
+        files_by_source.setdefault(m["Source"], set()).add(os.path.basename(m["File"]))
+
+    urls = {}
+    for source, files in files_by_source.items():
+        if len(files) != 1:
+            continue
+        for name, url in url_dict.items():
+            if source.lower() in name.lower():
+                urls[files.pop()] = url
+                break
+
+    return urls
+
+def download_file(url, filename, metadata, lock):
+    ''' Downloads one workbook with a conditional request. If the saved ETag or Last-Modified still match, the server answers 304 and nothing is written. An interrupted download is kept as a ".part" file and resumed with a Range request the next time, as long as the file on the server has not changed. The finished file replaces the old one atomically, but only if it is a workbook (an xlsx file is a zip archive); anything else, such as an HTML page, is thrown away.
+    
+    PARAMETERS
+    ----------
+    url: str
+        The URL to download.
+
+    filename: str
+        Where to save the file.
+
+    metadata: dict
+        Validators from earlier downloads, keyed by URL. Updated in place.
+
+    lock: threading.Lock
+        Guards metadata, which is shared between download threads.
+
+    RETURNS
+    -------
+    str:
+        "Downloaded", "Not Modified", or "Failed" if the download was not a workbook.
+    '''
+
+    part = filename + ".part"
+    with lock:
+        saved = dict(metadata.get(url, {}))
+
+    headers = {}
+    if os.path.exists(filename):
+        if saved.get("ETag"):
+            headers["If-None-Match"] = saved["ETag"]
+        if saved.get("Last-Modified"):
+            headers["If-Modified-Since"] = saved["Last-Modified"]
+
+    partial_validator = saved.get("Partial ETag") or saved.get("Partial Last-Modified")
+    if os.path.exists(part) and partial_validator:
+        headers["Range"] = f"bytes={os.path.getsize(part)}-"
+        headers["If-Range"] = partial_validator
+
+    with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 304:
+            return "Not Modified"
+
+        if response.status_code == 416:
+            os.remove(part)
+        response.raise_for_status()
+
+        if response.status_code == 206:
+            etag = saved.get("Partial ETag")
+            last_modified = saved.get("Partial Last-Modified")
+        else:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            with lock:
+                metadata[url] = {**saved, "Partial ETag": etag, "Partial Last-Modified": last_modified}
+
+        with open(part, "ab" if response.status_code == 206 else "wb") as file_obj:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK):
+                file_obj.write(chunk)
+
+    if not zipfile.is_zipfile(part):
+        os.remove(part)
+        with lock:
+            metadata[url] = {"ETag": saved.get("ETag"), "Last-Modified": saved.get("Last-Modified")}
+        return "Failed"
+
+    os.replace(part, filename)
+    with lock:
+        metadata[url] = {"ETag": etag, "Last-Modified": last_modified}
+    return "Downloaded"
+
+def download_ers_datasets(url_dict=None, directory=ERS_DATA_DIR):
+    ''' Downloads the USDA ERS workbooks concurrently with download_file(), so unchanged files are never fetched again and, since their modification times do not change, never re-parsed by clean_excel_data(). The ETag and Last-Modified of each file are kept in a DOWNLOAD_METADATA file inside the directory.
+    
+    PARAMETERS
+    ----------
+    url_dict: dict
+        Workbook file names and the URLs to download them from. Defaults to ers_download_urls(build_county_url_dict()), which has no URL for the two education workbooks.
+
+    directory: str
+        The folder the files go in. The default is the folder ERS_METRICS reads from.
+
+    RETURNS
+    -------
+    dict:
+        Each workbook file name with "Downloaded", "Not Modified" or "Failed".
+    '''
+
+    if url_dict is None:
+        url_dict = ers_download_urls(build_county_url_dict())
+
+    os.makedirs(directory, exist_ok=True)
+    metadata_file = os.path.join(directory, DOWNLOAD_METADATA)
+    try:
+        with open(metadata_file) as file_obj:
+            metadata = json.load(file_obj)
+    except (FileNotFoundError, json.JSONDecodeError):
+        metadata = {}
+    lock = threading.Lock()
+
+    def fetch(filename):
+        try:
+            return download_file(url_dict[filename], os.path.join(directory, filename), metadata, lock)
+        except (requests.exceptions.RequestException, OSError):
+            return "Failed"
+
+    try:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            results = dict(zip(url_dict, pool.map(fetch, url_dict)))
+    finally:
+        write_to_json(metadata_file, metadata)
+
+    return results
+
+def serve_fixture_workbooks(directory):
+    ''' Starts a local HTTP stand-in for the USDA ERS server on a free port, in a daemon thread. It serves the workbooks in a folder with an ETag and Last-Modified, answers conditional requests with 304 and Range requests with 206, and serves an HTML report page for any other path.
+    
+    PARAMETERS
+    ----------
+    directory: str
+        The folder of fixture workbooks to serve.
+
+    RETURNS
+    -------
+    http.server.ThreadingHTTPServer:
+        The running server. Its address is server.server_address, server.ranges lists the (path, first byte) of each resumed request, and server.shutdown() stops it.
+    '''
+
+    class FixtureHandler(http.server.SimpleHTTPRequestHandler):
+        def do_GET(self):
+            path = self.translate_path(self.path)
+            if not os.path.isfile(path):
+                body = b"<html><body>USDA ERS report page</body></html>"
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            with open(path, "rb") as file_obj:
+                body = file_obj.read()
+            etag = f'"{int(os.path.getmtime(path))}-{len(body)}"'
+            last_modified = self.date_time_string(int(os.path.getmtime(path)))
+
+            if self.headers.get("If-None-Match") == etag or self.headers.get("If-Modified-Since") == last_modified:
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            start = 0
+            if self.headers.get("Range") and self.headers.get("If-Range") in (etag, last_modified):
+                start = int(self.headers["Range"].split("=")[1].split("-")[0])
+                if start >= len(body):
+                    self.send_response(416)
+                    self.end_headers()
+                    return
+                self.server.ranges.append((self.path, start))
+
+            self.send_response(206 if start else 200)
+            self.send_header("Content-Type", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            self.send_header("Content-Length", str(len(body) - start))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            if start:
+                self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+            self.end_headers()
+            self.wfile.write(body[start:])
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(FixtureHandler, directory=directory))
+    server.ranges = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def check_ers_downloads(fixture_dir=ERS_DATA_DIR):
+    ''' Runs download_ers_datasets() against serve_fixture_workbooks() in a temporary folder and prints whether each behaviour works: a first download, no re-download of unchanged files, resuming a ".part" file, and refusing an HTML page in place of a workbook.
+    
+    PARAMETERS
+    ----------
+    fixture_dir: str
+        The folder of workbooks to serve. The default is the bundled "socioeconomic_data" folder.
+
+    RETURNS
+    -------
+    dict:
+        Each check with True if it passed.
+    '''
+
+    files = sorted({os.path.basename(m["File"]) for m in ERS_METRICS})
+    server = serve_fixture_workbooks(fixture_dir)
+    base_url = "http://%s:%s/" % server.server_address
+    url_dict = {f: base_url + f for f in files}
+    checks = {}
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            def same_as_fixture(f):
+                with open(os.path.join(directory, f), "rb") as a, open(os.path.join(fixture_dir, f), "rb") as b:
+                    return a.read() == b.read()
+
+            results = download_ers_datasets(url_dict, directory)
+            checks["First Download"] = all(results[f] == "Downloaded" and same_as_fixture(f) for f in files)
+
+            mtimes = {f: os.path.getmtime(os.path.join(directory, f)) for f in files}
+            results = download_ers_datasets(url_dict, directory)
+            checks["Not Modified"] = all(results[f] == "Not Modified" and os.path.getmtime(os.path.join(directory, f)) == mtimes[f] for f in files)
+
+            resumed = files[0]
+            with open(os.path.join(fixture_dir, resumed), "rb") as file_obj:
+                body = file_obj.read()
+            os.remove(os.path.join(directory, resumed))
+            with open(os.path.join(directory, resumed + ".part"), "wb") as file_obj:
+                file_obj.write(body[:len(body) // 2])
+            metadata_file = os.path.join(directory, DOWNLOAD_METADATA)
+            with open(metadata_file) as file_obj:
+                metadata = json.load(file_obj)
+            metadata[url_dict[resumed]] = {"Partial ETag": metadata[url_dict[resumed]]["ETag"]}
+            write_to_json(metadata_file, metadata)
+            results = download_ers_datasets(url_dict, directory)
+            checks["Resume"] = results[resumed] == "Downloaded" and same_as_fixture(resumed) and server.ranges == [("/" + resumed, len(body) // 2)]
+
+            refused = files[1]
+            results = download_ers_datasets({refused: base_url + "reports.aspx?ID=17828"}, directory)
+            checks["Refuse HTML"] = results[refused] == "Failed" and same_as_fixture(refused) and not os.path.exists(os.path.join(directory, refused + ".part"))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    for check, passed in checks.items():
+        print(f"{check}: {'passed' if passed else 'FAILED'}")
+    return checks
+
 def npr_covid_data_dict():
     ''' Scrapes COVID-19 table on NPR webpage. Creates nested dictionary where each key has a dictionary value with "Cases" and "Deaths" as keys and numeric integers as values.
     
@@ -64,7 +390,7 @@ def npr_covid_data_dict():
     '''
 
     npr_url = "https://apps.npr.org/dailygraphics/graphics/coronavirus-d3-us-map-20200312/table.html?initialWidth=1238&childId=responsive-embed-coronavirus-d3-us-map-20200312-table&parentTitle=Coronavirus%20Map%20And%20Graphics%3A%20Track%20The%20Spread%20In%20The%20U.S.%20%3A%20Shots%20-%20Health%20News%20%3A%20NPR&parentUrl=https%3A%2F%2Fwww.npr.org%2Fsections%2Fhealth-shots%2F2020%2F03%2F16%2F816707182%2Fmap-tracking-the-spread-of-the-coronavirus-in-the-u-s"
-    npr_response = requests.get(npr_url)
+    npr_response = requests.get(npr_url, timeout=REQUEST_TIMEOUT)
     npr_soup = BeautifulSoup(npr_response.text, 'html.parser')
 
     covid_nums = {}
@@ -106,7 +432,7 @@ def npr_covid_data_time_pulled():
     '''
 
     npr_url = "https://apps.npr.org/dailygraphics/graphics/coronavirus-d3-us-map-20200312/table.html?initialWidth=1238&childId=responsive-embed-coronavirus-d3-us-map-20200312-table&parentTitle=Coronavirus%20Map%20And%20Graphics%3A%20Track%20The%20Spread%20In%20The%20U.S.%20%3A%20Shots%20-%20Health%20News%20%3A%20NPR&parentUrl=https%3A%2F%2Fwww.npr.org%2Fsections%2Fhealth-shots%2F2020%2F03%2F16%2F816707182%2Fmap-tracking-the-spread-of-the-coronavirus-in-the-u-s"
-    npr_response = requests.get(npr_url)
+    npr_response = requests.get(npr_url, timeout=REQUEST_TIMEOUT)
     npr_soup = BeautifulSoup(npr_response.text, 'html.parser')
 
     time = []
@@ -116,64 +442,31 @@ def npr_covid_data_time_pulled():
     
     return time[0]
 
-def build_usda_ers_dict(dict1, dict2, dict3, dict4, dict5, dict6):
-    ''' Combines 6 dictionaries into 1. Creates a nested dictionary where each key has a dictionary value with "Population", "Median Household Income", "Poverty Rate", "Unemployment Rate", "Completed HS Only Rate", and "College Completion Rate" as keys.
+def build_usda_ers_dict(*dicts):
+    ''' Combines any number of dictionaries made by build_socioecon_dict() into 1 in a single keyed pass. Only names that appear in every dictionary are kept.
     
     PARAMETERS
     ----------
-    dict1: dict
-        A dictionary to be combined.
-    
-    dict2: dict
-        A dictionary to be combined.
-    
-    dict3: dict
-        A dictionary to be combined.
-    
-    dict4: dict
-        A dictionary to be combined.
-    
-    dict5: dict
-        A dictionary to be combined.
-    
-    dict6: dict
-        A dictionary to be combined.
+    *dicts: dict
+        The dictionaries to be combined, in the order their keys should appear.
 
     RETURNS
     -------
     dict:
-        Nested dictionary with each key having a dictionary with 6 keys ("Population", "Median Household Income", "Poverty Rate", "Unemployment Rate", "Completed HS Only Rate", "College Completion Rate").
+        Nested dictionary with each key having a dictionary with 1 key per input dictionary.
         Example:
             {"Michigan": {"Population": INT, "Median Household Income": INT, "Poverty Rate": FLOAT, "Unemployment Rate": FLOAT, "Completed HS Only Rate": FLOAT, "College Completion Rate": FLOAT}}
     '''
 
-    socioecon = {**dict1, **dict2, **dict3, **dict4, **dict5, **dict6}
-
-    for key, value in socioecon.items():
-        if key in dict1 and key in dict2 and key in dict3 and key in dict4 and key in dict5 and key in dict6:
-            socioecon[key] = [
-                value,
-                dict1[key],
-                dict2[key],
-                dict3[key],
-                dict4[key],
-                dict5[key]
-            ]
-    
-    socioecon2 = {}
-
-    for k, items in socioecon.items():
-        socioecon2[k] = {
-            'Population': items[1]['Population'],
-            'Median Household Income': items[0]['Median Household Income'],
-            'Poverty Rate': items[2]['Poverty Rate'],
-            'Unemployment Rate': items[5]['Unemployment Rate'],
-            "Completed HS Only Rate": items[3]["Completed HS Only Rate"],
-            "College Completion Rate": items[4]["College Completion Rate"],
+    socioecon = {}
+    counts = {}
 
-        }
+    for d in dicts:
+        for name, value in d.items():
+            socioecon.setdefault(name, {}).update(value)
+            counts[name] = counts.get(name, 0) + 1
 
-    return socioecon2
+    return {name: value for name, value in socioecon.items() if counts[name] == len(dicts)}
 
 def build_socioecon_dict(names, data, key):
     ''' Takes in a list of names and values to create a nested dictionary where each key has a dictionary value with 'key' parameter as the key and 'data' parameter as the value.
@@ -205,405 +498,2236 @@ def build_socioecon_dict(names, data, key):
     
     return socioecon
 
-def get_excel_data(workbook, sheet, cellrange):
-    ''' Opens an Excel workbook. Reads data in specified worksheet and cell range. Returns the data as a list.
+def create_database(db_name=DB_NAME):
+    ''' Creates a SQL database with 9 tables: "CovidCounty", "CovidState", "SocioeconomicStates", "SocioeconomicCounties" (filled from COUNTY_ERS_FILE by load_county_socioeconomic_data(), and empty if that file is missing), the "CovidStateDaily" and "CovidNationDaily" rollup tables, the "CountyRanks" rank table, the "CovidCountyQuarantine" table for rejected CSV rows, and the "DistributionSketches" quantile sketch table.
+    
+    PARAMETERS
+    ----------
+    db_name: str
+        The SQL database file to create. Defaults to DB_NAME.
+
+    RETURNS
+    -------
+    none
+    '''
+
+    conn = sqlite3.connect(db_name)
+    cur = conn.cursor()
+
+    drop_county_covid_sql = "DROP TABLE IF EXISTS 'CovidCounty'"
+    drop_state_covid_sql = "DROP TABLE IF EXISTS 'CovidState'"
+    drop_states_usda_sql = "DROP TABLE IF EXISTS 'SocioeconomicStates'"
+    drop_mi_usda_sql = "DROP TABLE IF EXISTS 'SocioeconomicMichigan'"
+    drop_counties_usda_sql = "DROP TABLE IF EXISTS 'SocioeconomicCounties'"
+    drop_state_daily_sql = "DROP TABLE IF EXISTS 'CovidStateDaily'"
+    drop_nation_daily_sql = "DROP TABLE IF EXISTS 'CovidNationDaily'"
+    drop_county_ranks_sql = "DROP TABLE IF EXISTS 'CountyRanks'"
+    drop_quarantine_sql = "DROP TABLE IF EXISTS 'CovidCountyQuarantine'"
+    drop_sketches_sql = "DROP TABLE IF EXISTS 'DistributionSketches'"
+
+    create_county_covid_sql = '''
+        CREATE TABLE IF NOT EXISTS "CovidCounty" (
+            "Id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "Date" TEXT NOT NULL,
+            "County" TEXT NOT NULL,
+            "StateName" TEXT NOT NULL,
+            "Fips" INTEGER,
+            "CountyCases" INTEGER,
+            "CountyDeaths" INTEGER
+        )
+    '''
+
+    ers_columns = "".join(f''',
+            "State{m['Column']}" {m['Type']} NOT NULL''' for m in ERS_METRICS)
+
+    create_states_usda_sql = f'''
+        CREATE TABLE IF NOT EXISTS "SocioeconomicStates" (
+            "Id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "StateName" TEXT NOT NULL{ers_columns}
+        )
+    '''
+
+    county_ers_columns = "".join(f''',
+            "County{m['Column']}" {m['Type']}''' for m in ERS_METRICS)
+
+    create_counties_usda_sql = f'''
+        CREATE TABLE IF NOT EXISTS "SocioeconomicCounties" (
+            "Fips" INTEGER PRIMARY KEY,
+            "CountyName" TEXT NOT NULL{county_ers_columns}
+        )
+    '''
+
+    create_state_daily_sql = '''
+        CREATE TABLE IF NOT EXISTS "CovidStateDaily" (
+            "StateName" TEXT NOT NULL,
+            "Date" TEXT NOT NULL,
+            "StateCases" INTEGER NOT NULL,
+            "StateDeaths" INTEGER NOT NULL,
+            "CountyCount" INTEGER NOT NULL,
+            PRIMARY KEY ("StateName", "Date")
+        )
+    '''
+
+    create_nation_daily_sql = '''
+        CREATE TABLE IF NOT EXISTS "CovidNationDaily" (
+            "Date" TEXT PRIMARY KEY,
+            "NationCases" INTEGER NOT NULL,
+            "NationDeaths" INTEGER NOT NULL,
+            "CountyCount" INTEGER NOT NULL
+        )
+    '''
+
+    create_county_date_index_sql = '''
+        CREATE INDEX IF NOT EXISTS "CovidCountyDateIdx" ON "CovidCounty" ("Date")
+    '''
+
+    create_county_ranks_sql = '''
+        CREATE TABLE IF NOT EXISTS "CountyRanks" (
+            "StateName" TEXT NOT NULL,
+            "County" TEXT NOT NULL,
+            "Fips" INTEGER,
+            "Metric" TEXT NOT NULL,
+            "Value" DECIMAL NOT NULL,
+            "NationRank" INTEGER NOT NULL,
+            "StateRank" INTEGER NOT NULL,
+            PRIMARY KEY ("StateName", "County", "Metric")
+        )
+    '''
+
+    create_county_ranks_nation_index_sql = '''
+        CREATE INDEX IF NOT EXISTS "CountyRanksNationIdx" ON "CountyRanks" ("Metric", "NationRank")
+    '''
+
+    create_county_ranks_state_index_sql = '''
+        CREATE INDEX IF NOT EXISTS "CountyRanksStateIdx" ON "CountyRanks" ("Metric", "StateName", "StateRank")
+    '''
+
+    create_quarantine_sql = '''
+        CREATE TABLE IF NOT EXISTS "CovidCountyQuarantine" (
+            "Id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "Date" TEXT,
+            "County" TEXT,
+            "StateName" TEXT,
+            "Fips" TEXT,
+            "CountyCases" TEXT,
+            "CountyDeaths" TEXT,
+            "Reason" TEXT NOT NULL,
+            "Loaded" INTEGER NOT NULL
+        )
+    '''
+
+    create_sketches_sql = '''
+        CREATE TABLE IF NOT EXISTS "DistributionSketches" (
+            "StateName" TEXT NOT NULL,
+            "Metric" TEXT NOT NULL,
+            "Bucket" INTEGER,
+            "Decade" INTEGER NOT NULL,
+            "BucketCount" INTEGER NOT NULL,
+            "BucketMax" DECIMAL NOT NULL
+        )
+    '''
+
+    cur.execute(drop_county_covid_sql)
+    cur.execute(drop_state_covid_sql)
+    cur.execute(drop_states_usda_sql)
+    cur.execute(drop_mi_usda_sql)
+    cur.execute(drop_counties_usda_sql)
+    cur.execute(drop_state_daily_sql)
+    cur.execute(drop_nation_daily_sql)
+    cur.execute(drop_county_ranks_sql)
+    cur.execute(drop_quarantine_sql)
+    cur.execute(drop_sketches_sql)
+    cur.execute(create_county_covid_sql)
+    create_state_covid_table(cur)
+    cur.execute(create_states_usda_sql)
+    cur.execute(create_counties_usda_sql)
+    cur.execute(create_state_daily_sql)
+    cur.execute(create_nation_daily_sql)
+    cur.execute(create_county_date_index_sql)
+    cur.execute(create_county_ranks_sql)
+    cur.execute(create_county_ranks_nation_index_sql)
+    cur.execute(create_county_ranks_state_index_sql)
+    cur.execute(create_quarantine_sql)
+    cur.execute(create_sketches_sql)
+
+    conn.commit()
+    conn.close()
+
+    CORRELATION_CACHE.clear()
+
+def create_state_covid_table(cur, table="CovidState"):
+    ''' Creates a table with the "CovidState" schema under the given name.
     
     PARAMETERS
     ----------
-    workbook: str
-        The name of a workbook to be accessed.
+    cur: sqlite3.Cursor
+        An open cursor on the database.
+
+    table: str
+        The name of the table to create.
+
+    RETURNS
+    -------
+    none
+    '''
+
+    create_state_covid_sql = f'''
+        CREATE TABLE IF NOT EXISTS "{table}" (
+            "Id" INTEGER PRIMARY KEY AUTOINCREMENT,
+            "Name" TEXT NOT NULL,
+            "StateCases" INTEGER NOT NULL,
+            "StateDeaths" INTEGER NOT NULL,
+            "TimePulled" TEXT
+        )
+    '''
+
+    cur.execute(create_state_covid_sql)
+
+def insert_state_covid_rows(cur, table, npr_data, time_pulled):
+    ''' Inserts NPR state COVID-19 numbers into a table with the "CovidState" schema.
     
-    sheet: str
-        The name of a sheet within the workbook.
+    PARAMETERS
+    ----------
+    cur: sqlite3.Cursor
+        An open cursor on the database.
+
+    table: str
+        The name of the table to fill.
 
-    cellrange: str
-        The cell range of the data to be accessed.
+    npr_data: dict
+        The output of npr_covid_data_dict().
+
+    time_pulled: str
+        The output of npr_covid_data_time_pulled().
 
     RETURNS
     -------
-    list:
-        The data returned from the cell range specified.
+    none
+    '''
+
+    insert_state_covid_sql = f'''
+        INSERT INTO "{table}"
+        VALUES (NULL, ?, ?, ?, ?)
+    '''
+
+    for k,v in npr_data.items():
+        cur.execute(insert_state_covid_sql, [
+            k,
+            v['Cases'],
+            v['Deaths'],
+            time_pulled
+        ])
+
+def scrape_npr_snapshot():
+    ''' Scrapes NPR's state COVID-19 table and the time it was updated. Raises one of NPR_ERRORS if NPR cannot be reached or its table is missing or has changed.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    tuple:
+        The output of npr_covid_data_dict() and npr_covid_data_time_pulled() as a string.
+    '''
+
+    return npr_covid_data_dict(), str(npr_covid_data_time_pulled())
+
+def refresh_state_snapshot():
+    ''' Re-scrapes NPR, loads the numbers into a "CovidStateStaging" table and swaps it in for "CovidState" in a single transaction. The database is switched to WAL mode so readers keep seeing the previous snapshot until the swap commits, without waiting on it.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    float:
+        The seconds the refresh took.
+    '''
+
+    start = time.perf_counter()
+    npr_data, time_pulled = scrape_npr_snapshot()
+
+    conn = sqlite3.connect(DB_NAME, isolation_level=None)
+    cur = conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+
+    cur.execute("BEGIN")
+    cur.execute("DROP TABLE IF EXISTS CovidStateStaging")
+    create_state_covid_table(cur, "CovidStateStaging")
+    insert_state_covid_rows(cur, "CovidStateStaging", npr_data, time_pulled)
+    cur.execute("COMMIT")
+
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("DROP TABLE IF EXISTS CovidState")
+    cur.execute("ALTER TABLE CovidStateStaging RENAME TO CovidState")
+    cur.execute("COMMIT")
+    conn.close()
+
+    return time.perf_counter() - start
+
+def refresh_loop(interval, jitter, max_backoff):
+    ''' Calls refresh_state_snapshot() every interval seconds, plus or minus a random jitter, until REFRESH_STOP is set. The first refresh waits one interval, since populate_database() has just loaded NPR. After a failure it retries sooner, doubling the wait from REFRESH_RETRY up to max_backoff. Results are recorded in REFRESH_METRICS.
+    
+    PARAMETERS
+    ----------
+    interval: float
+        Seconds between successful refreshes.
+
+    jitter: float
+        The most seconds to add to or take from each wait.
+
+    max_backoff: float
+        The longest wait after repeated failures.
+
+    RETURNS
+    -------
+    none
+    '''
+
+    wait = interval
+    while not REFRESH_STOP.wait(max(0, wait + random.uniform(-jitter, jitter))):
+        try:
+            latency = refresh_state_snapshot()
+        except NPR_ERRORS + (sqlite3.Error,):
+            REFRESH_METRICS["Failures"] += 1
+            REFRESH_METRICS["Consecutive Failures"] += 1
+            wait = min(REFRESH_RETRY * 2 ** (REFRESH_METRICS["Consecutive Failures"] - 1), max_backoff)
+        else:
+            REFRESH_METRICS.update({
+                "Refreshes": REFRESH_METRICS["Refreshes"] + 1,
+                "Consecutive Failures": 0,
+                "Last Latency": latency,
+                "Last Refresh": time.time()
+            })
+            wait = interval
+
+def start_background_refresh(interval=REFRESH_INTERVAL, jitter=REFRESH_JITTER, max_backoff=REFRESH_MAX_BACKOFF):
+    ''' Starts a daemon thread that keeps the "CovidState" snapshot up to date with NPR.
+    
+    PARAMETERS
+    ----------
+    interval: float
+        Seconds between successful refreshes.
+
+    jitter: float
+        The most seconds to add to or take from each wait.
+
+    max_backoff: float
+        The longest wait after repeated failures.
+
+    RETURNS
+    -------
+    threading.Thread:
+        The running refresh thread.
     '''
 
-    data = []
+    REFRESH_STOP.clear()
+    thread = threading.Thread(target=refresh_loop, args=(interval, jitter, max_backoff), daemon=True)
+    thread.start()
+    return thread
+
+def stop_background_refresh():
+    ''' Tells the background refresh thread to stop after its current refresh.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    none
+    '''
+
+    REFRESH_STOP.set()
+
+def get_refresh_metrics():
+    ''' Returns the background refresh metrics, including how stale the current snapshot is.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    dict:
+        REFRESH_METRICS plus "Staleness", the seconds since the last successful refresh (None if there has not been one).
+    '''
+
+    metrics = dict(REFRESH_METRICS)
+    if metrics["Last Refresh"] is None:
+        metrics["Staleness"] = None
+    else:
+        metrics["Staleness"] = time.time() - metrics["Last Refresh"]
+    return metrics
+
+def access_state_snapshot():
+    ''' Makes a request to SQL database for the current NPR state snapshot. If NPR has not been reached, the latest day of the "CovidStateDaily" rollup table is used instead.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    tuple:
+        A string saying when the data is accurate as of, and a list of (Name, Cases, Deaths) tuples.
+    '''
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    result = cur.execute("SELECT Name, StateCases, StateDeaths, TimePulled FROM CovidState ORDER BY Id").fetchall()
+
+    if result:
+        conn.close()
+        return result[0][3], [r[:3] for r in result]
+
+    date = cur.execute("SELECT MAX(Date) FROM CovidStateDaily").fetchone()[0]
+    result = cur.execute("SELECT StateName, StateCases, StateDeaths FROM CovidStateDaily WHERE Date = ? ORDER BY StateName", [date]).fetchall()
+    conn.close()
+    return date, result
+
+def load_county_socioeconomic_data(cur, filename=COUNTY_ERS_FILE):
+    ''' Fills the "SocioeconomicCounties" table from a CSV file of county-level USDA ERS data. The file has a header row with "Fips", "County" and then the "Name" of each metric in ERS_METRICS (for example "Population"), and one row per county. Blank values are stored as NULL. The county-level data sets listed by build_county_url_dict() have these fields, keyed by FIPS code.
+    
+    PARAMETERS
+    ----------
+    cur: sqlite3.Cursor
+        An open cursor on the database.
+
+    filename: str
+        The path to the CSV file. Defaults to COUNTY_ERS_FILE.
+
+    RETURNS
+    -------
+    int:
+        The number of counties loaded, or 0 if the file does not exist.
+    '''
+
+    insert_county_ers_sql = f'''
+        INSERT OR REPLACE INTO SocioeconomicCounties
+        VALUES (?, ?{", ?" * len(ERS_METRICS)})
+    '''
+
+    if not os.path.exists(filename):
+        return 0
+
+    def convert(value, sql_type):
+        if value.strip() == "":
+            return None
+        return int(float(value)) if sql_type == "INTEGER" else float(value)
+
+    with open(filename, 'r') as csvfile:
+        rows = [[int(r["Fips"]), r["County"]] + [convert(r[m["Name"]], m["Type"]) for m in ERS_METRICS] for r in csv.DictReader(csvfile)]
+
+    cur.executemany(insert_county_ers_sql, rows)
+    return len(rows)
+
+def populate_database():
+    ''' Populates the tables in SQL database with data from a variety of sources. The state-by-day and nation-by-day rollup tables are built from the county data, so they are available even if NPR cannot be reached. When USE_SHARDS is set, the county data is loaded into the state shards by create_sharded_database() instead of "CovidCounty".
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    none
+    '''
+
+    data_header = []
+    data_rows = []
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+
+    # county populations are needed before the per-capita county ranks are built
+    load_county_socioeconomic_data(cur)
+    conn.commit()
+
+    if USE_SHARDS:
+        create_sharded_database()
+    else:
+        with open("covid_data/us-counties.csv", 'r') as csvfile:
+            data = []
+            csv_header = csv.reader(csvfile)
+            for h in csv_header:
+                data.append(h)
+            data_header.extend(data[0])
+            data_rows.extend(data[1:])
+
+        insert_county_covid_rows(cur, data_rows)
+        update_rollup_tables(cur)
+        update_rank_tables(cur)
+        update_distribution_sketches(cur)
+
+    try:
+        npr_data, time_pulled = scrape_npr_snapshot()
+        REFRESH_METRICS["Last Refresh"] = time.time()
+    except NPR_ERRORS:
+        npr_data = {}
+        time_pulled = None
+
+    insert_state_covid_rows(cur, "CovidState", npr_data, time_pulled)
+    
+    insert_state_ers_sql = f'''
+        INSERT INTO SocioeconomicStates
+        VALUES (Null, ?{", ?" * len(ERS_METRICS)})
+    '''
+    
+    with open("USDA_ERS_Data.json") as file_obj:
+        for k, v in json.load(file_obj).items():
+            cur.execute(insert_state_ers_sql, [k] + [v[m['Name']] for m in ERS_METRICS])
+
+    conn.commit()
+    conn.close()
+
+    CORRELATION_CACHE.clear()
+    NEIGHBOR_INDEX.clear()
+    build_neighbor_index("state")
+    build_neighbor_index("county")
+
+def validate_county_rows(rows, last_seen, broken):
+    ''' Checks NYT county CSV rows against VALIDATION_RULES in one pass: 6 fields, a 5-digit FIPS code (except for the counties in FIPS_EXCEPTIONS), an ISO date later than the county's previous row, non-negative integer counts, and cases and deaths that do not drop below the county's previous row. The FIPS codes and counts are converted once here, so the loaded rows can be inserted without SQLite converting the strings again. Rows are yielded as they are checked, so they can be streamed into executemany() without building a second copy of the data.
+    
+    PARAMETERS
+    ----------
+    rows: list
+        CSV rows (date, county, state, fips, cases, deaths).
+
+    last_seen: dict
+        Each county's latest loaded row, as converted values, keyed by FIPS code (or by county name for the counties in FIPS_EXCEPTIONS). Updated in place for every row that is loaded, which includes rows breaking only a rule in FLAGGED_RULES.
+
+    broken: dict
+        Filled in with the index of every row that breaks a rule and the name of the first rule it breaks.
+
+    RETURNS
+    -------
+    generator:
+        The converted values (date, county, state, fips, cases, deaths) of every row that is loaded, in order, with the FIPS code as an int (None for the counties in FIPS_EXCEPTIONS).
+    '''
+
+    checked_dates = set()
+    checked_fips = {}
+    checked_counts = {}
+
+    for i, row in enumerate(rows):
+        try:
+            date, county, state, fips, cases, deaths = row
+        except ValueError:
+            broken[i] = "Row Length"
+            continue
+
+        fips_code = checked_fips.get(fips)
+        if fips_code is None:
+            if len(fips) == 5 and fips.isdigit():
+                fips_code = checked_fips[fips] = int(fips)
+            elif not (fips == "" and county in FIPS_EXCEPTIONS):
+                broken[i] = "Fips Format"
+                continue
+
+        if date not in checked_dates:
+            try:
+                datetime.date.fromisoformat(date)
+            except ValueError:
+                broken[i] = "Date Format"
+                continue
+            checked_dates.add(date)
+
+        # The same counts come up again and again, so each string is only converted once
+        try:
+            if cases not in checked_counts:
+                checked_counts[cases] = int(cases)
+            if deaths not in checked_counts:
+                checked_counts[deaths] = int(deaths)
+        except ValueError:
+            broken[i] = "Count Format"
+            continue
+        cases = checked_counts[cases]
+        deaths = checked_counts[deaths]
+
+        if cases < 0 or deaths < 0:
+            broken[i] = "Negative Count"
+            continue
+
+        key = fips_code or county
+        previous = last_seen.get(key)
+
+        if previous is not None:
+            if date <= previous[0]:
+                broken[i] = "Date Order"
+                continue
+            if cases < previous[4] or deaths < previous[5]:
+                broken[i] = "Cumulative Decrease"
+
+        last_seen[key] = values = (date, county, state, fips_code, cases, deaths)
+        yield values
+
+def insert_county_covid_rows(cur, rows):
+    ''' Validates NYT county CSV rows (date, county, state, fips, cases, deaths) and inserts the valid ones into the "CovidCounty" table. Rows that break a rule are stored in "CovidCountyQuarantine" with the rule as the reason. Rows that only break a rule in FLAGGED_RULES (a downward revision by the NYT) are recorded there but still loaded, so the county keeps counting towards the rollups for that day. The areas in FIPS_EXCEPTIONS have no FIPS code, so their Fips is stored as NULL.
+    
+    PARAMETERS
+    ----------
+    cur: sqlite3.Cursor
+        An open cursor on the database.
+    
+    rows: list
+        A list of CSV rows, each a list of 6 strings.
+
+    RETURNS
+    -------
+    set:
+        The dates found in the inserted rows.
+    '''
+
+    insert_county_covid_sql = '''
+        INSERT INTO CovidCounty
+        VALUES (NULL, ?, ? , ?, ?, ?, ?)
+    '''
+
+    insert_quarantine_sql = '''
+        INSERT INTO CovidCountyQuarantine
+        VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+
+    # SQLite takes the bare columns from the row holding MAX(Date), i.e. each county's latest loaded row
+    last_seen_sql = '''
+        SELECT IFNULL(Fips, County), MAX(Date), County, StateName, Fips, CountyCases, CountyDeaths
+        FROM CovidCounty
+        GROUP BY IFNULL(Fips, County)
+    '''
+
+    last_seen = {}
+    for key, date, county, state, fips, cases, deaths in cur.execute(last_seen_sql).fetchall():
+        last_seen[key] = (date, county, state, fips, cases, deaths)
+
+    broken = {}
+    cur.executemany(insert_county_covid_sql, validate_county_rows(rows, last_seen, broken))
+
+    quarantined = [(list(rows[i]) + [None] * 6)[:6] + [reason, int(reason in FLAGGED_RULES)] for i, reason in broken.items()]
+    cur.executemany(insert_quarantine_sql, quarantined)
+
+    return {dr[0] for i, dr in enumerate(rows) if i not in broken or broken[i] in FLAGGED_RULES}
+
+def access_quarantine_counts():
+    ''' Makes a request to SQL database for how many CSV rows were quarantined or flagged under each validation rule.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    dict:
+        Every rule in VALIDATION_RULES with its count of rows. Rows under FLAGGED_RULES were still loaded.
+        Example:
+            {"Fips Format": INT, "Cumulative Decrease": INT}
+    '''
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    query = '''
+        SELECT Reason, COUNT(*)
+        FROM CovidCountyQuarantine
+        GROUP BY Reason
+    '''
+    result = dict(cur.execute(query).fetchall())
+    conn.close()
+
+    return {rule: result.get(rule, 0) for rule in VALIDATION_RULES}
+
+def update_rollup_tables(cur, dates=None):
+    ''' Recomputes the "CovidStateDaily" and "CovidNationDaily" rollup tables from "CovidCounty". If dates are given, only those days are recomputed; otherwise both tables are rebuilt.
+    
+    PARAMETERS
+    ----------
+    cur: sqlite3.Cursor
+        An open cursor on the database.
+    
+    dates: iterable
+        The dates (YYYY-MM-DD strings) to recompute. None rebuilds every day.
+
+    RETURNS
+    -------
+    none
+    '''
+
+    state_rollup_sql = '''
+        INSERT OR REPLACE INTO CovidStateDaily
+        SELECT StateName, Date, SUM(CountyCases), SUM(CountyDeaths), COUNT(*)
+        FROM CovidCounty
+        {where}
+        GROUP BY StateName, Date
+    '''
+
+    nation_rollup_sql = '''
+        INSERT OR REPLACE INTO CovidNationDaily
+        SELECT Date, SUM(StateCases), SUM(StateDeaths), SUM(CountyCount)
+        FROM CovidStateDaily
+        {where}
+        GROUP BY Date
+    '''
+
+    if dates is None:
+        cur.execute("DELETE FROM CovidStateDaily")
+        cur.execute("DELETE FROM CovidNationDaily")
+        cur.execute(state_rollup_sql.format(where=""))
+        cur.execute(nation_rollup_sql.format(where=""))
+        return
+
+    for d in sorted(set(dates)):
+        cur.execute("DELETE FROM CovidStateDaily WHERE Date = ?", [d])
+        cur.execute(state_rollup_sql.format(where="WHERE Date = ?"), [d])
+        cur.execute(nation_rollup_sql.format(where="WHERE Date = ?"), [d])
+
+def check_rollup_tables(cur):
+    ''' Checks that the "CovidStateDaily" and "CovidNationDaily" rollup tables equal the sums of the loaded county rows in "CovidCounty".
+    
+    PARAMETERS
+    ----------
+    cur: sqlite3.Cursor
+        An open cursor on the database.
+
+    RETURNS
+    -------
+    list:
+        The dates whose rollups do not match. Empty if they all match.
+    '''
+
+    state_check_sql = '''
+        SELECT cc.Date
+        FROM (SELECT StateName, Date, SUM(CountyCases) as Cases, SUM(CountyDeaths) as Deaths, COUNT(*) as Counties
+              FROM CovidCounty GROUP BY StateName, Date) as cc
+            LEFT JOIN CovidStateDaily as sd
+            ON sd.StateName = cc.StateName AND sd.Date = cc.Date
+        WHERE sd.StateCases IS NOT cc.Cases OR sd.StateDeaths IS NOT cc.Deaths OR sd.CountyCount IS NOT cc.Counties
+    '''
+
+    nation_check_sql = '''
+        SELECT cc.Date
+        FROM (SELECT Date, SUM(CountyCases) as Cases, SUM(CountyDeaths) as Deaths, COUNT(*) as Counties
+              FROM CovidCounty GROUP BY Date) as cc
+            LEFT JOIN CovidNationDaily as nd
+            ON nd.Date = cc.Date
+        WHERE nd.NationCases IS NOT cc.Cases OR nd.NationDeaths IS NOT cc.Deaths OR nd.CountyCount IS NOT cc.Counties
+    '''
+
+    dates = {r[0] for r in cur.execute(state_check_sql).fetchall()}
+    dates.update(r[0] for r in cur.execute(nation_check_sql).fetchall())
+    return sorted(dates)
+
+def update_rank_tables(cur):
+    ''' Rebuilds the "CountyRanks" table from "CovidCounty". Each county gets its national and in-state rank for every metric in RANK_METRICS, so top-K queries only read the first K index entries. Growth is the increase in cases over the last GROWTH_DAYS days. The per-capita metrics are only ranked when the "SocioeconomicCounties" table has county populations.
+    
+    PARAMETERS
+    ----------
+    cur: sqlite3.Cursor
+        An open cursor on the database.
+
+    RETURNS
+    -------
+    none
+    '''
+
+    totals_sql = '''
+        CREATE TEMP TABLE CountyTotals AS
+        SELECT StateName, County, MAX(Fips) as Fips, MAX(CountyCases) as Cases, MAX(CountyDeaths) as Deaths,
+            MAX(CountyCases) - IFNULL(MAX(CASE WHEN Date <= date((SELECT MAX(Date) FROM CovidCounty), ?) THEN CountyCases END), 0) as Growth
+        FROM CovidCounty
+        GROUP BY StateName, County
+    '''
+
+    cur.execute("DROP TABLE IF EXISTS temp.CountyTotals")
+    cur.execute(totals_sql, [f"-{GROWTH_DAYS} day"])
+    rank_county_totals(cur)
+
+def rank_county_totals(cur):
+    ''' Fills the "CountyRanks" table from a temporary "CountyTotals" table of each county's Cases, Deaths and Growth, then drops it. The per-capita metrics are only ranked when the "SocioeconomicCounties" table has county populations.
+    
+    PARAMETERS
+    ----------
+    cur: sqlite3.Cursor
+        An open cursor on the database.
+
+    RETURNS
+    -------
+    none
+    '''
+
+    insert_ranks_sql = '''
+        INSERT INTO CountyRanks
+        SELECT StateName, County, Fips, ?, Value,
+            RANK() OVER (ORDER BY Value DESC),
+            RANK() OVER (PARTITION BY StateName ORDER BY Value DESC)
+        FROM (SELECT StateName, County, Fips, {expr} as Value FROM CountyTotals)
+        WHERE Value IS NOT NULL
+    '''
+
+    has_county_data = cur.execute("SELECT COUNT(*) FROM SocioeconomicCounties").fetchone()[0]
+
+    cur.execute("DELETE FROM CountyRanks")
+    for metric, expr in RANK_METRICS.items():
+        if "SocioeconomicCounties" in expr and not has_county_data:
+            continue
+        cur.execute(insert_ranks_sql.format(expr=expr), [metric])
+
+    cur.execute("DROP TABLE temp.CountyTotals")
+
+def update_distribution_sketches(cur):
+    ''' Rebuilds the "DistributionSketches" table from "CountyRanks". For each state and metric, county values are counted in logarithmic buckets (each SKETCH_ACCURACY wide, relative to the value), with zeros in a NULL bucket. Each bucket is also split by the exact power of ten its values fall in ("Decade", 0 for values below 1), since a bucket can straddle 10, 100 and so on. Sketches merge by adding bucket counts, so national summaries never rescan county rows.
+    
+    PARAMETERS
+    ----------
+    cur: sqlite3.Cursor
+        An open cursor on the database.
+
+    RETURNS
+    -------
+    none
+    '''
+
+    insert_sketch_sql = '''
+        INSERT INTO DistributionSketches
+        VALUES (?, ?, ?, ?, ?, ?)
+    '''
+
+    values = {}
+    for state, metric, value in cur.execute("SELECT StateName, Metric, Value FROM CountyRanks").fetchall():
+        values.setdefault((state, metric), []).append(value)
+
+    rows = []
+    for (state, metric), v in values.items():
+        v = np.array(v, dtype=float)
+        positive = v[v > 0]
+        buckets = np.ceil(np.log(positive) / math.log(SKETCH_GAMMA)).astype(np.int64)
+        powers = np.floor(np.log10(np.maximum(positive, 1)))
+        powers += 10.0 ** (powers + 1) <= positive
+        powers -= 10.0 ** powers > np.maximum(positive, 1)
+        decades = np.where(positive < 1, 0, 10 ** powers.astype(np.int64))
+        if len(positive) < len(v):
+            rows.append((state, metric, None, 0, len(v) - len(positive), 0))
+        for bucket, decade in set(zip(buckets.tolist(), decades.tolist())):
+            in_bucket = positive[(buckets == bucket) & (decades == decade)]
+            rows.append((state, metric, bucket, decade, len(in_bucket), float(in_bucket.max())))
+
+    cur.execute("DELETE FROM DistributionSketches")
+    cur.executemany(insert_sketch_sql, rows)
+
+def add_county_covid_data(filename):
+    ''' Appends new days of NYT county data from a CSV file to the database (or to the state shards, when USE_SHARDS is set) and updates the rollup tables for only those days.
+    
+    PARAMETERS
+    ----------
+    filename: str
+        The path to a CSV file in the NYT us-counties format, with a header row.
+
+    RETURNS
+    -------
+    set:
+        The dates that were added or updated.
+    '''
+
+    with open(filename, 'r') as csvfile:
+        data_rows = list(csv.reader(csvfile))[1:]
+
+    if USE_SHARDS:
+        dates = create_sharded_database(data_rows)
+    else:
+        conn = sqlite3.connect(DB_NAME)
+        cur = conn.cursor()
+
+        dates = insert_county_covid_rows(cur, data_rows)
+        update_rollup_tables(cur, dates)
+        update_rank_tables(cur)
+        update_distribution_sketches(cur)
+
+        conn.commit()
+        conn.close()
+
+    CORRELATION_CACHE.clear()
+    NEIGHBOR_INDEX.clear()
+    build_neighbor_index("state")
+    build_neighbor_index("county")
+    return dates
+
+def clean_county_covid_data():
+    ''' Reads in COVID-19 CSV data, skips rows that validate_county_rows() would quarantine, cleans it by converting numeric string data into numeric data, and then creates a nested dictionary.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    dict:
+        A nested dictionary for each state with county names and county COVID-19 data as values.
+        Example:
+            {"Michigan": {"Washtenaw": {"Cases": INT, "Deaths": INT}}}
+    '''
+
+    data_header = []
+    data_rows = []
+    county_dict = {}
+
+    with open("covid_data/us-counties.csv", 'r') as csvfile:
+        data = []
+        csv_header = csv.reader(csvfile)
+        for h in csv_header:
+            data.append(h)
+        data_header.extend(data[0])
+        data_rows.extend(data[1:])
+
+    for dr in validate_county_rows(data_rows, {}, {}):
+        if dr[2] not in county_dict:
+            county_dict[dr[2]] = {
+                dr[1]: {
+                    "Cases": dr[4],
+                    "Deaths": dr[5]
+                }
+            }
+        elif dr[2] in county_dict:
+            county_dict[dr[2]].update(
+            {
+                dr[1]: {
+                    "Cases": dr[4],
+                    "Deaths": dr[5]
+                }
+            }
+            )
+
+    return county_dict
+
+def clean_nums(data):
+    ''' Takes in a value and removes a comma in order to convert the value into an integer.
+    
+    PARAMETERS
+    ----------
+    data: str
+        A value to be cleaned.
+
+    RETURNS
+    -------
+    int:
+        The value in integer form.
+    '''
+
+    data = data.replace(',','')
+    return int(data)
+
+def income_to_int(values):
+    ''' Takes in a string of income data and removes both "$" and "," to produce a clean integer.
+    
+    PARAMETERS
+    ----------
+    values: list
+        A list of income values to be cleaned.
+
+    RETURNS
+    -------
+    list:
+        A cleaned list of the income values in integer form.
+    '''
+
+    list_of_values = []
+
+    for v in values: 
+        v = v.replace("$",'')
+        v = v.replace(',','')
+        list_of_values.append(int(v))
+
+    return list_of_values
+
+def convert_to_percent(values):
+    ''' Attempts to convert a list of values into a float in percentage format.
+    
+    PARAMETERS
+    ----------
+    values: list
+        A list of values to be converted into float percentage format.
+
+    RETURNS
+    list:
+        The list of values where the value are either in float percentage format or their original form.
+    -------
+    '''
+
+    list_of_values = []
+    
+    for v in values:
+        try:
+            percent = float('{0:.2f}'.format((v * 100)))
+            list_of_values.append(percent)
+        except:
+            list_of_values.append(v)
+    
+    return list_of_values
+
+ERS_TRANSFORMS = {"income_to_int": income_to_int, "convert_to_percent": convert_to_percent}
+
+def write_to_json(filename, data):
+    ''' Takes in data and writes it out into JSON format.
+    
+    PARAMETERS
+    ----------
+    filename: str
+        The name of the JSON file to be created.
+    
+    data: dict
+        The data to be written into the JSON file.
+
+    RETURNS
+    -------
+    none
+    '''
+
+    with open(filename, "w") as file_obj:
+        json.dump(data, file_obj, indent=4)
+
+def extract_ers_metrics(metrics):
+    ''' Reads every metric in a registry like ERS_METRICS from its workbook, opening each workbook only once, and builds a dictionary per metric.
+    
+    PARAMETERS
+    ----------
+    metrics: list
+        Dictionaries with "Name", "File", "Sheet", "Names" and "Values" cell ranges, and an optional "Transform", a key of ERS_TRANSFORMS naming the function applied to the values.
+
+    RETURNS
+    -------
+    list:
+        One dictionary per metric, made by build_socioecon_dict(), in registry order.
+    '''
+
+    unknown = [m["Name"] for m in metrics if m["Transform"] is not None and m["Transform"] not in ERS_TRANSFORMS]
+    if unknown:
+        raise ValueError(f"Unknown transform for {', '.join(unknown)}; expected one of {', '.join(ERS_TRANSFORMS)}")
+
+    workbooks = {}
+    for m in metrics:
+        if m["File"] not in workbooks:
+            workbooks[m["File"]] = load_workbook(m["File"])
+
+    extracted = []
+    for m in metrics:
+        ws = workbooks[m["File"]][m["Sheet"]]
+        names = [cells.value for r in ws[m["Names"]] for cells in r]
+        values = [cells.value for r in ws[m["Values"]] for cells in r]
+        if m["Transform"] is not None:
+            values = ERS_TRANSFORMS[m["Transform"]](values)
+        extracted.append(build_socioecon_dict(names, values, m["Name"]))
+
+    return extracted
+
+def ers_json_is_current():
+    ''' Checks whether "USDA_ERS_Data.json" can be used as is: it must be newer than every workbook in ERS_METRICS and have a value for every metric in ERS_METRICS, so editing the registry also triggers a re-parse.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    bool:
+        True if the JSON file is up to date.
+    '''
+
+    try:
+        json_time = os.path.getmtime("USDA_ERS_Data.json")
+        if any(os.path.getmtime(m["File"]) > json_time for m in ERS_METRICS):
+            return False
+        with open("USDA_ERS_Data.json") as file_obj:
+            data = json.load(file_obj)
+    except (OSError, json.JSONDecodeError):
+        return False
+
+    return bool(data) and all(m["Name"] in v for v in data.values() for m in ERS_METRICS)
+
+def clean_excel_data():
+    ''' Extracts every metric in ERS_METRICS from the XLSX data, joins them into one dictionary per state and then writes that data to JSON file. Nothing is re-parsed if ers_json_is_current() says the JSON file is up to date.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    none
+    '''
+
+    if ers_json_is_current():
+        return
+
+    usda_ers_data = build_usda_ers_dict(*extract_ers_metrics(ERS_METRICS))
+
+    # writing data to json
+    write_to_json("USDA_ERS_Data.json", usda_ers_data)
+
+def access_state_sql_database(state):
+    ''' Makes a request to SQL database to access state-specific information on COVID-19 data and returns it as a list. When USE_SHARDS is set, only the state's own shard is read.
+    
+    PARAMETERS
+    ----------
+    state: str
+        The state for which the user would like to see data on.
+
+    RETURNS
+    -------
+    list:
+        The results of the SQL query.
+    '''
+
+    conn = sqlite3.connect(shard_filename(state) if USE_SHARDS else DB_NAME)
+    cur = conn.cursor()
+    query = f'''
+        SELECT StateName, County, MAX(CountyCases), MAX(CountyDeaths)
+        FROM CovidCounty
+        WHERE StateName = "{state}"
+        GROUP BY County
+        ORDER BY MAX(CountyCases) DESC
+    '''
+    result = cur.execute(query).fetchall()
+    conn.close()
+    return result
+
+def access_national_sql_database():
+    ''' Makes a request to SQL database to access state information on COVID-19 data, USDA ERS socioeconomic data for each state, and returns it as a list. If no NPR data was loaded, the latest day of the "CovidStateDaily" rollup table is used instead.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    list:
+        The results of the SQL query.
+    '''
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    npr_rows = cur.execute("SELECT COUNT(*) FROM CovidState").fetchone()[0]
+    conn.close()
+
+    if npr_rows == 0:
+        if USE_SHARDS:
+            return access_national_shard_database()
+        return access_national_rollup_database()
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    query = '''
+        SELECT Name, MAX(StateCases), MAX(StateDeaths), ss.StatePopulation, ss.StateMedianIncome, ss.StateUnemploymentRate, ss.StatePovertyRate, ss.StateCompCollRate, ss.StateCompHSOnlyRate
+        FROM CovidState
+            JOIN SocioeconomicStates as ss
+            ON CovidState.Name = ss.StateName
+        GROUP BY Name
+        ORDER BY MAX(StateCases) DESC
+    '''
+    result = cur.execute(query).fetchall()
+    conn.close()
+    return result
+
+def access_national_rollup_database(date=None):
+    ''' Makes a request to SQL database to access each state's COVID-19 totals for one day from the "CovidStateDaily" rollup table, along with USDA ERS socioeconomic data, and returns it as a list in the same shape as access_national_sql_database().
+    
+    PARAMETERS
+    ----------
+    date: str
+        The day (YYYY-MM-DD) to report. Defaults to the latest day in the rollup table.
+
+    RETURNS
+    -------
+    list:
+        The results of the SQL query.
+    '''
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    if date is None:
+        date = cur.execute("SELECT MAX(Date) FROM CovidNationDaily").fetchone()[0]
+    query = '''
+        SELECT sd.StateName, sd.StateCases, sd.StateDeaths, ss.StatePopulation, ss.StateMedianIncome, ss.StateUnemploymentRate, ss.StatePovertyRate, ss.StateCompCollRate, ss.StateCompHSOnlyRate
+        FROM CovidStateDaily as sd
+            JOIN SocioeconomicStates as ss
+            ON sd.StateName = ss.StateName
+        WHERE sd.Date = ?
+        ORDER BY sd.StateCases DESC
+    '''
+    result = cur.execute(query, [date]).fetchall()
+    conn.close()
+    return result
+
+def shard_filename(state):
+    ''' Returns the name of the SQL database file holding one state's county data in the sharded layout. Rows with no state name go to an "Unrouted" shard.
+    
+    PARAMETERS
+    ----------
+    state: str
+        The name of the state.
+
+    RETURNS
+    -------
+    str:
+        The file name inside SHARD_DIR.
+    '''
+
+    return os.path.join(SHARD_DIR, (state or "Unrouted").replace(" ", "_") + ".sqlite")
+
+def populate_shard(state, rows, append=False):
+    ''' Creates one state's shard, or adds rows to it, and fills its "CovidCounty", rollup and rank tables. Runs inside a worker process during create_sharded_database().
+    
+    PARAMETERS
+    ----------
+    state: str
+        The name of the state.
+
+    rows: list
+        The NYT county CSV rows for this state.
+
+    append: bool
+        If True, the rows are added to an existing shard and only their days are rolled up again.
+
+    RETURNS
+    -------
+    set:
+        The dates found in the inserted rows.
+    '''
+
+    filename = shard_filename(state)
+    if not append or not os.path.exists(filename):
+        create_database(filename)
+
+    conn = sqlite3.connect(filename)
+    cur = conn.cursor()
+
+    dates = insert_county_covid_rows(cur, rows)
+    update_rollup_tables(cur, dates if append else None)
+    update_rank_tables(cur)
+
+    conn.commit()
+    conn.close()
+    return dates
+
+def create_sharded_database(rows=None):
+    ''' Builds the optional sharded layout: the county rows are split into one SQL database file per state in SHARD_DIR, loaded in parallel by worker processes, and never loaded into DB_NAME. The small per-state summary tables are then gathered into DB_NAME by gather_shard_summaries(), so the national readers still query one file.
+    
+    PARAMETERS
+    ----------
+    rows: list
+        NYT county CSV rows to add to the existing shards. None rebuilds every shard from "covid_data/us-counties.csv".
+
+    RETURNS
+    -------
+    set:
+        The dates found in the inserted rows.
+    '''
+
+    os.makedirs(SHARD_DIR, exist_ok=True)
+
+    append = rows is not None
+    if not append:
+        for filename in os.listdir(SHARD_DIR):
+            if filename.endswith(".sqlite"):
+                os.remove(os.path.join(SHARD_DIR, filename))
+        with open("covid_data/us-counties.csv", 'r') as csvfile:
+            rows = list(csv.reader(csvfile))[1:]
+
+    rows_by_state = {}
+    for dr in rows:
+        rows_by_state.setdefault(dr[2] if len(dr) > 2 else "", []).append(dr)
+
+    with ProcessPoolExecutor(max_workers=SHARD_WORKERS) as pool:
+        loaded = list(pool.map(populate_shard, rows_by_state.keys(), rows_by_state.values(), [append] * len(rows_by_state)))
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    gather_shard_summaries(cur)
+    conn.commit()
+    conn.close()
+
+    return set().union(*loaded)
+
+def gather_shard_summaries(cur):
+    ''' Copies the "CovidStateDaily" rollup, "CountyRanks" and "CovidCountyQuarantine" rows from every shard in SHARD_DIR into DB_NAME, then rebuilds the "CovidNationDaily" rollup, the national ranks and the "DistributionSketches" table from them. The ranks are recomputed here because each shard only ranks its own counties, and because the county populations for the per-capita metrics are only kept in DB_NAME. Growth keeps each shard's own GROWTH_DAYS window.
+    
+    PARAMETERS
+    ----------
+    cur: sqlite3.Cursor
+        An open cursor on DB_NAME.
+
+    RETURNS
+    -------
+    none
+    '''
+
+    copy_quarantine_sql = '''
+        INSERT INTO CovidCountyQuarantine
+        SELECT NULL, Date, County, StateName, Fips, CountyCases, CountyDeaths, Reason, Loaded
+        FROM shard.CovidCountyQuarantine
+    '''
+
+    nation_rollup_sql = '''
+        INSERT INTO CovidNationDaily
+        SELECT Date, SUM(StateCases), SUM(StateDeaths), SUM(CountyCount)
+        FROM CovidStateDaily
+        GROUP BY Date
+    '''
+
+    totals_sql = '''
+        CREATE TEMP TABLE CountyTotals AS
+        SELECT StateName, County, MAX(Fips) as Fips,
+            MAX(CASE WHEN Metric = 'Cases' THEN Value END) as Cases,
+            MAX(CASE WHEN Metric = 'Deaths' THEN Value END) as Deaths,
+            MAX(CASE WHEN Metric = 'Growth' THEN Value END) as Growth
+        FROM ShardRanks
+        GROUP BY StateName, County
+    '''
+
+    for table in ["CovidStateDaily", "CovidNationDaily", "CovidCountyQuarantine", "CountyRanks"]:
+        cur.execute(f"DELETE FROM {table}")
+    cur.execute("DROP TABLE IF EXISTS temp.ShardRanks")
+    cur.execute("CREATE TEMP TABLE ShardRanks AS SELECT * FROM CountyRanks")
+    cur.connection.commit()
+
+    # ATTACH and DETACH are not allowed inside a transaction, so each shard is committed before the next
+    for filename in sorted(os.listdir(SHARD_DIR)):
+        if not filename.endswith(".sqlite"):
+            continue
+        cur.execute("ATTACH DATABASE ? AS shard", [os.path.join(SHARD_DIR, filename)])
+        cur.execute("INSERT INTO CovidStateDaily SELECT * FROM shard.CovidStateDaily")
+        cur.execute(copy_quarantine_sql)
+        cur.execute("INSERT INTO temp.ShardRanks SELECT * FROM shard.CountyRanks")
+        cur.connection.commit()
+        cur.execute("DETACH DATABASE shard")
+
+    cur.execute(nation_rollup_sql)
+    cur.execute("DROP TABLE IF EXISTS temp.CountyTotals")
+    cur.execute(totals_sql)
+    rank_county_totals(cur)
+    cur.execute("DROP TABLE temp.ShardRanks")
+    update_distribution_sketches(cur)
+
+def access_shard_latest_totals(state):
+    ''' Makes a request to one state's shard for its latest day of COVID-19 totals.
+    
+    PARAMETERS
+    ----------
+    state: str
+        The name of the state.
+
+    RETURNS
+    -------
+    tuple:
+        (StateName, StateCases, StateDeaths), or None if the shard is empty.
+    '''
+
+    conn = sqlite3.connect(shard_filename(state))
+    cur = conn.cursor()
+    query = '''
+        SELECT StateName, StateCases, StateDeaths
+        FROM CovidStateDaily
+        ORDER BY Date DESC
+        LIMIT 1
+    '''
+    result = cur.execute(query).fetchone()
+    conn.close()
+    return result
+
+def access_national_shard_database():
+    ''' Fans a query out across every state shard with a thread pool and merges the latest state totals with the USDA ERS socioeconomic data, in the same shape as access_national_sql_database().
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    list:
+        The merged results, ordered by cases.
+    '''
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    query = '''
+        SELECT StateName, StatePopulation, StateMedianIncome, StateUnemploymentRate, StatePovertyRate, StateCompCollRate, StateCompHSOnlyRate
+        FROM SocioeconomicStates
+    '''
+    socioecon = {r[0]: r[1:] for r in cur.execute(query).fetchall()}
+    conn.close()
+
+    states = [s for s in socioecon if os.path.exists(shard_filename(s))]
+    with ThreadPoolExecutor(max_workers=SHARD_WORKERS) as pool:
+        totals = pool.map(access_shard_latest_totals, states)
+
+    result = [(*t, *socioecon[t[0]]) for t in totals if t is not None]
+    result.sort(key=lambda r: r[1], reverse=True)
+    return result
+
+def benchmark_storage_modes(repeat=5):
+    ''' Times loading and querying the county data in the single-file and sharded layouts, and prints the results. Both layouts are rebuilt, so DB_NAME is repopulated from scratch and is left in the sharded layout's state, with no "CovidCounty" rows. The load times cover the same work in each mode: reading the CSV and building the county, rollup, rank and sketch tables, which for the sharded layout includes gathering the summaries into DB_NAME. The single-file load is timed on a scratch copy, so the NPR scrape, USDA ERS rows and neighbor indexes made by populate_database() are left out.
+    
+    PARAMETERS
+    ----------
+    repeat: int
+        How many times each query is run; the best time is kept.
+
+    RETURNS
+    -------
+    dict:
+        Seconds taken by each step in each mode.
+        Example:
+            {"Single": {"Load": FLOAT, "State Query": FLOAT, "National Query": FLOAT}, "Sharded": {...}}
+    '''
+
+    global USE_SHARDS
+
+    def best_time(func, *args):
+        times = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    results = {}
+    saved_mode = USE_SHARDS
+
+    USE_SHARDS = False
+    create_database()
+    populate_database()
+
+    scratch_file = DB_NAME.replace(".sqlite", "_benchmark.sqlite")
+    start = time.perf_counter()
+    with open("covid_data/us-counties.csv", 'r') as csvfile:
+        data_rows = list(csv.reader(csvfile))[1:]
+    create_database(scratch_file)
+    conn = sqlite3.connect(scratch_file)
+    cur = conn.cursor()
+    insert_county_covid_rows(cur, data_rows)
+    update_rollup_tables(cur)
+    update_rank_tables(cur)
+    update_distribution_sketches(cur)
+    conn.commit()
+    conn.close()
+    single_load = time.perf_counter() - start
+    os.remove(scratch_file)
+
+    start = time.perf_counter()
+    create_sharded_database()
+    sharded_load = time.perf_counter() - start
+
+    for mode, load_time, national_func in [("Single", single_load, access_national_rollup_database), ("Sharded", sharded_load, access_national_shard_database)]:
+        USE_SHARDS = mode == "Sharded"
+        results[mode] = {
+            "Load": load_time,
+            "State Query": best_time(access_state_sql_database, "Michigan"),
+            "National Query": best_time(national_func)
+        }
+        print(f"{mode}: Load - {results[mode]['Load']:.3f}s | State Query - {results[mode]['State Query'] * 1000:.2f}ms | National Query - {results[mode]['National Query'] * 1000:.2f}ms")
+
+    USE_SHARDS = saved_mode
+    return results
+
+def access_state_trend_sql_database(state):
+    ''' Makes a request to SQL database to access a state's day-by-day COVID-19 totals from the "CovidStateDaily" rollup table.
+    
+    PARAMETERS
+    ----------
+    state: str
+        The state for which the user would like to see data on.
+
+    RETURNS
+    -------
+    list:
+        The results of the SQL query as (Date, StateCases, StateDeaths, CountyCount) tuples, oldest first.
+    '''
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    query = '''
+        SELECT Date, StateCases, StateDeaths, CountyCount
+        FROM CovidStateDaily
+        WHERE StateName = ?
+        ORDER BY Date
+    '''
+    result = cur.execute(query, [state]).fetchall()
+    conn.close()
+    return result
+
+def access_nation_trend_sql_database():
+    ''' Makes a request to SQL database to access the nation's day-by-day COVID-19 totals from the "CovidNationDaily" rollup table.
+    
+    PARAMETERS
+    ----------
+    none
+
+    RETURNS
+    -------
+    list:
+        The results of the SQL query as (Date, NationCases, NationDeaths, CountyCount) tuples, oldest first.
+    '''
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    query = '''
+        SELECT Date, NationCases, NationDeaths, CountyCount
+        FROM CovidNationDaily
+        ORDER BY Date
+    '''
+    result = cur.execute(query).fetchall()
+    conn.close()
+    return result
+
+def access_top_counties(metric="Cases", k=10, state=None):
+    ''' Makes a request to SQL database for the top-K counties by a metric, nationally or within one state, using the precomputed "CountyRanks" table.
+    
+    PARAMETERS
+    ----------
+    metric: str
+        One of the keys of RANK_METRICS.
+
+    k: int
+        The number of counties to return.
+
+    state: str
+        If given, rank only the counties in this state.
+
+    RETURNS
+    -------
+    list:
+        The results of the SQL query as (Rank, County, StateName, Value) tuples, highest first. Ties share a rank, so more than K rows may be returned.
+    '''
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    if state is None:
+        query = '''
+            SELECT NationRank, County, StateName, Value
+            FROM CountyRanks
+            WHERE Metric = ? AND NationRank <= ?
+            ORDER BY NationRank
+        '''
+        result = cur.execute(query, [metric, k]).fetchall()
+    else:
+        query = '''
+            SELECT StateRank, County, StateName, Value
+            FROM CountyRanks
+            WHERE Metric = ? AND StateName = ? AND StateRank <= ?
+            ORDER BY StateRank
+        '''
+        result = cur.execute(query, [metric, state, k]).fetchall()
+    conn.close()
+    return result
+
+def access_county_rank(county, state):
+    ''' Makes a request to SQL database for a county's rank within its state and the nation for every ranked metric.
+    
+    PARAMETERS
+    ----------
+    county: str
+        The name of the county.
+
+    state: str
+        The state the county is in.
+
+    RETURNS
+    -------
+    dict:
+        Nested dictionary keyed by metric.
+        Example:
+            {"Cases": {"Value": INT, "State Rank": INT, "National Rank": INT}}
+    '''
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    query = '''
+        SELECT Metric, Value, StateRank, NationRank
+        FROM CountyRanks
+        WHERE StateName = ? AND County = ?
+    '''
+    result = cur.execute(query, [state, county]).fetchall()
+    conn.close()
+
+    ranks = {}
+    for metric, value, state_rank, nation_rank in result:
+        ranks[metric] = {
+            "Value": value,
+            "State Rank": state_rank,
+            "National Rank": nation_rank
+        }
+    return ranks
+
+def access_distribution_summary(metric="Cases", state=None):
+    ''' Makes a request to SQL database for the quantile sketch of a county metric in one state, or for the whole nation by merging every state's sketch, and summarizes it.
+    
+    PARAMETERS
+    ----------
+    metric: str
+        One of the keys of RANK_METRICS.
+
+    state: str
+        The state to summarize. None summarizes the nation.
+
+    RETURNS
+    -------
+    dict:
+        The number of counties, the SKETCH_QUANTILES (accurate to within SKETCH_ACCURACY), the exact maximum, and an exact histogram of (low, high, count) tuples by power of ten, where low <= value < high.
+        Example:
+            {"Count": INT, "Median": FLOAT, "P90": FLOAT, "P99": FLOAT, "Max": FLOAT, "Histogram": [(0, 1, INT), (1, 10, INT)]}
+    '''
+
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    query = '''
+        SELECT Bucket, SUM(BucketCount), MAX(BucketMax)
+        FROM DistributionSketches
+        WHERE Metric = ? AND (? IS NULL OR StateName = ?)
+        GROUP BY Bucket
+        ORDER BY Bucket
+    '''
+    histogram_query = '''
+        SELECT Decade, SUM(BucketCount)
+        FROM DistributionSketches
+        WHERE Metric = ? AND (? IS NULL OR StateName = ?)
+        GROUP BY Decade
+        ORDER BY Decade
+    '''
+    result = cur.execute(query, [metric, state, state]).fetchall()
+    histogram = cur.execute(histogram_query, [metric, state, state]).fetchall()
+    conn.close()
+
+    summary = {"Count": sum(r[1] for r in result)}
+    if not result:
+        summary.update({name: None for name in SKETCH_QUANTILES})
+        summary.update({"Max": None, "Histogram": []})
+        return summary
+
+    estimates = []
+    for bucket, count, bucket_max in result:
+        if bucket is None:
+            estimates.append(0)
+        else:
+            estimates.append(min(2 * SKETCH_GAMMA ** bucket / (SKETCH_GAMMA + 1), bucket_max))
 
-    wb = load_workbook(workbook)
-    ws = wb[sheet]
-    rows = ws[cellrange]
+    cumulative = np.cumsum([r[1] for r in result])
+    for name, q in SKETCH_QUANTILES.items():
+        summary[name] = estimates[int(np.searchsorted(cumulative, q * (summary["Count"] - 1), side="right"))]
+    summary["Max"] = max(r[2] for r in result)
 
-    for r in rows:
-        for cells in r:
-            data.append(cells.value)
+    summary["Histogram"] = [(low, max(1, low * 10), count) for low, count in histogram]
 
-    return data
+    return summary
 
-def create_database():
-    ''' Creates a SQL database with 3 tables: "CovidCounty", "CovidState", "SocioeconomicStates". 
+def get_correlation_data(level="state"):
+    ''' Makes a request to SQL database for each region's socioeconomic metrics and latest COVID-19 totals, and arranges them as a matrix. States use the "CovidStateDaily" rollup table; counties use the "CountyRanks" table, and are only available when the "SocioeconomicCounties" table has been filled by load_county_socioeconomic_data().
     
     PARAMETERS
     ----------
-    none
+    level: str
+        Either "state" or "county".
 
     RETURNS
     -------
-    none
+    tuple:
+        A list of region names and a NumPy array with one row per region. The columns are the SOCIOECON_METRICS followed by the COVID_OUTCOMES. Regions missing a population or any metric are left out.
     '''
 
+    columns = ", ".join(f"se.{level.capitalize()}{col}" for col in SOCIOECON_METRICS.values())
+
+    if level == "state":
+        query = f'''
+            SELECT sd.StateName, sd.StateCases, sd.StateDeaths, se.StatePopulation, {columns}
+            FROM CovidStateDaily as sd
+                JOIN SocioeconomicStates as se
+                ON sd.StateName = se.StateName
+            WHERE sd.Date = (SELECT MAX(Date) FROM CovidStateDaily)
+        '''
+    elif level == "county":
+        query = f'''
+            SELECT cr.County, cr.Value, dr.Value, se.CountyPopulation, {columns}
+            FROM CountyRanks as cr
+                JOIN CountyRanks as dr
+                ON dr.Fips = cr.Fips AND dr.Metric = 'Deaths'
+                JOIN SocioeconomicCounties as se
+                ON cr.Fips = se.Fips
+            WHERE cr.Metric = 'Cases'
+        '''
+    else:
+        return [], np.empty((0, len(SOCIOECON_METRICS) + len(COVID_OUTCOMES)))
+
     conn = sqlite3.connect(DB_NAME)
     cur = conn.cursor()
+    result = cur.execute(query).fetchall()
+    conn.close()
 
-    drop_county_covid_sql = "DROP TABLE IF EXISTS 'CovidCounty'"
-    drop_state_covid_sql = "DROP TABLE IF EXISTS 'CovidState'"
-    drop_states_usda_sql = "DROP TABLE IF EXISTS 'SocioeconomicStates'"
-    drop_mi_usda_sql = "DROP TABLE IF EXISTS 'SocioeconomicMichigan'"
+    complete = [r for r in result if r[3] and None not in r]
+    names = [r[0] for r in complete]
+    raw = np.array([r[1:] for r in complete], dtype=float).reshape(-1, 3 + len(SOCIOECON_METRICS))
+    per_capita = raw[:, 0:2] / raw[:, 2:3] * 100000
 
-    create_county_covid_sql = '''
-        CREATE TABLE IF NOT EXISTS "CovidCounty" (
-            "Id" INTEGER PRIMARY KEY AUTOINCREMENT,
-            "Date" TEXT NOT NULL,
-            "County" TEXT NOT NULL,
-            "StateName" TEXT NOT NULL,
-            "Fips" INTEGER NOT NULL,
-            "CountyCases" INTEGER,
-            "CountyDeaths" INTEGER
-        )
-    '''
+    return names, np.hstack([raw[:, 3:], per_capita])
 
-    create_state_covid_sql = '''
-        CREATE TABLE IF NOT EXISTS "CovidState" (
-            "Id" INTEGER PRIMARY KEY AUTOINCREMENT,
-            "Name" TEXT NOT NULL,
-            "StateCases" INTEGER NOT NULL,
-            "StateDeaths" INTEGER NOT NULL
-        )
-    '''
+def rank_columns(matrix):
+    ''' Replaces each column of a matrix with its ranks (1 = smallest), giving tied values their average rank.
+    
+    PARAMETERS
+    ----------
+    matrix: numpy.ndarray
+        A 2-D array of values.
 
-    create_states_usda_sql = '''
-        CREATE TABLE IF NOT EXISTS "SocioeconomicStates" (
-            "Id" INTEGER PRIMARY KEY AUTOINCREMENT,
-            "StateName" TEXT NOT NULL,
-            "StatePopulation" INTEGER NOT NULL,
-            "StateMedianIncome" INTEGER NOT NULL,
-            "StatePovertyRate" DECIMAL NOT NULL,
-            "StateUnemploymentRate" DECIMAL NOT NULL,
-            "StateCompHSOnlyRate" DECIMAL NOT NULL,
-            "StateCompCollRate" DECIMAL NOT NULL
-        )
+    RETURNS
+    -------
+    numpy.ndarray:
+        An array of the same shape holding the ranks.
     '''
 
-    cur.execute(drop_county_covid_sql)
-    cur.execute(drop_state_covid_sql)
-    cur.execute(drop_states_usda_sql)
-    cur.execute(drop_mi_usda_sql)
-    cur.execute(create_county_covid_sql)
-    cur.execute(create_state_covid_sql)
-    cur.execute(create_states_usda_sql)
-
-    conn.commit()
-    conn.close()
-
-def populate_database():
-    ''' Populates 3 tables in SQL database with data from a variety of sources.
+    ranks = np.empty_like(matrix, dtype=float)
+    for j in range(matrix.shape[1]):
+        order = np.argsort(matrix[:, j], kind="stable")
+        ordinal = np.empty(len(order))
+        ordinal[order] = np.arange(1, len(order) + 1)
+        _, inverse = np.unique(matrix[:, j], return_inverse=True)
+        ranks[:, j] = (np.bincount(inverse, ordinal) / np.bincount(inverse))[inverse]
+    return ranks
+
+def build_correlation_cache(level="state"):
+    ''' Computes the means, covariance matrix and rank correlation matrix of the socioeconomic metrics and COVID-19 outcomes for a level, and stores them in CORRELATION_CACHE. The cache is cleared whenever the database is reloaded.
     
     PARAMETERS
     ----------
+    level: str
+        Either "state" or "county".
 
     RETURNS
     -------
+    dict:
+        The cached entry with keys "Names", "Mean", "Covariance", "Rank Correlation".
     '''
 
-    data_header = []
-    data_rows = []
+    if level in CORRELATION_CACHE:
+        return CORRELATION_CACHE[level]
 
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
+    names, matrix = get_correlation_data(level)
+    n = len(names)
 
-    with open("covid_data/us-counties.csv", 'r') as csvfile:
-        data = []
-        csv_header = csv.reader(csvfile)
-        for h in csv_header:
-            data.append(h)
-        data_header.extend(data[0])
-        data_rows.extend(data[1:])
+    if n > 1:
+        covariance = np.cov(matrix, rowvar=False)
+        rank_correlation = np.corrcoef(rank_columns(matrix), rowvar=False)
+    else:
+        covariance = np.full((matrix.shape[1], matrix.shape[1]), np.nan)
+        rank_correlation = covariance
+
+    CORRELATION_CACHE[level] = {
+        "Names": names,
+        "Mean": matrix.mean(axis=0) if n else np.full(matrix.shape[1], np.nan),
+        "Covariance": covariance,
+        "Rank Correlation": rank_correlation
+    }
+    return CORRELATION_CACHE[level]
+
+def compute_correlations(level="state"):
+    ''' Relates each USDA ERS metric to per-capita COVID-19 cases and deaths. For every pair, returns the Pearson and Spearman correlations and a simple OLS fit (outcome = intercept + slope * metric), all read from the cached covariance matrices.
+    
+    PARAMETERS
+    ----------
+    level: str
+        Either "state" or "county".
 
-    insert_county_covid_sql = '''
-        INSERT INTO CovidCounty
-        VALUES (NULL, ?, ? , ?, ?, ?, ?)
+    RETURNS
+    -------
+    dict:
+        Nested dictionary keyed by metric, then by outcome.
+        Example:
+            {"Poverty Rate": {"Cases Per 100k": {"Pearson": FLOAT, "Spearman": FLOAT, "Slope": FLOAT, "Intercept": FLOAT, "R Squared": FLOAT, "N": INT}}}
     '''
 
-    for dr in data_rows:
-        cur.execute(insert_county_covid_sql, [
-            dr[0],
-            dr[1],
-            dr[2],
-            dr[3],
-            dr[4],
-            dr[5]
-        ])
+    cache = build_correlation_cache(level)
+    mean = cache["Mean"]
+    cov = cache["Covariance"]
+    std = np.sqrt(np.diag(cov))
+
+    m = len(SOCIOECON_METRICS)
+    pearson = cov[:m, m:] / np.outer(std[:m], std[m:])
+    slope = cov[:m, m:] / np.diag(cov)[:m, None]
+    intercept = mean[m:] - slope * mean[:m, None]
+    spearman = cache["Rank Correlation"][:m, m:]
+
+    results = {}
+    for i, metric in enumerate(SOCIOECON_METRICS):
+        results[metric] = {}
+        for j, outcome in enumerate(COVID_OUTCOMES):
+            results[metric][outcome] = {
+                "Pearson": float(pearson[i, j]),
+                "Spearman": float(spearman[i, j]),
+                "Slope": float(slope[i, j]),
+                "Intercept": float(intercept[i, j]),
+                "R Squared": float(pearson[i, j] ** 2),
+                "N": len(cache["Names"])
+            }
 
-    insert_state_covid_sql = '''
-        INSERT INTO CovidState
-        VALUES (NULL, ?, ?, ?)
-    '''
+    return results
 
-    for k,v in npr_covid_data_dict().items():
-        cur.execute(insert_state_covid_sql, [
-            k,
-            v['Cases'],
-            v['Deaths']
-        ])
+def neighbor_index_filename(level):
+    ''' Returns the name of the file the nearest-neighbor index for a level is saved to, next to the SQL database.
     
-    insert_state_ers_sql = '''
-        INSERT INTO SocioeconomicStates
-        VALUES (Null, ?, ?, ?, ?, ?, ?, ?)
+    PARAMETERS
+    ----------
+    level: str
+        Either "state" or "county".
+
+    RETURNS
+    -------
+    str:
+        The file name.
     '''
-    
-    with open("USDA_ERS_Data.json") as file_obj:
-        for k, v in json.load(file_obj).items():
-            cur.execute(insert_state_ers_sql, [
-                k,
-                v['Population'],
-                v['Median Household Income'],
-                v['Poverty Rate'],
-                v['Unemployment Rate'],
-                v['Completed HS Only Rate'],
-                v['College Completion Rate']
-            ])
 
-    conn.commit()
-    conn.close()
+    return DB_NAME.replace(".sqlite", f"_{level}_neighbors.npz")
 
-def clean_county_covid_data():
-    ''' Reads in COVID-19 CSV data, cleans it by converting numeric string data into numeric data, and then creates a nested dictionary.
+def build_neighbor_index(level="state"):
+    ''' Builds a nearest-neighbor index over the USDA ERS fields in ERS_METRICS for each state (or county, when the "SocioeconomicCounties" table has been filled). The features are standardized so no field dominates the distance, and a missing county value is treated as the mean. The index is kept in NEIGHBOR_INDEX and saved next to the SQL database.
     
     PARAMETERS
     ----------
-    none
+    level: str
+        Either "state" or "county".
 
     RETURNS
     -------
     dict:
-        A nested dictionary for each state with county names and county COVID-19 data as values.
-        Example:
-            {"Michigan": {"Washtenaw": {"Cases": INT, "Deaths": INT}}}
+        The index with keys "Names", "Features", "Covid", or None if there is no data for the level. Counties are named "County, State", since county names repeat across states.
     '''
 
-    data_header = []
-    data_rows = []
-    county_dict = {}
+    columns = ", ".join(f"se.{level.capitalize()}{m['Column']}" for m in ERS_METRICS)
+
+    if level == "state":
+        query = f'''
+            SELECT se.StateName, {columns}, IFNULL(sd.StateCases, 0), IFNULL(sd.StateDeaths, 0)
+            FROM SocioeconomicStates as se
+                LEFT JOIN CovidStateDaily as sd
+                ON sd.StateName = se.StateName AND sd.Date = (SELECT MAX(Date) FROM CovidStateDaily)
+        '''
+    elif level == "county":
+        query = f'''
+            SELECT se.CountyName || ', ' || IFNULL(cr.StateName, se.Fips), {columns}, IFNULL(cr.Value, 0), IFNULL(dr.Value, 0)
+            FROM SocioeconomicCounties as se
+                LEFT JOIN CountyRanks as cr
+                ON cr.Fips = se.Fips AND cr.Metric = 'Cases'
+                LEFT JOIN CountyRanks as dr
+                ON dr.Fips = se.Fips AND dr.Metric = 'Deaths'
+        '''
+    else:
+        return None
 
-    with open("covid_data/us-counties.csv", 'r') as csvfile:
-        data = []
-        csv_header = csv.reader(csvfile)
-        for h in csv_header:
-            data.append(h)
-        data_header.extend(data[0])
-        data_rows.extend(data[1:])
+    conn = sqlite3.connect(DB_NAME)
+    cur = conn.cursor()
+    result = cur.execute(query).fetchall()
+    conn.close()
 
-    for dr in data_rows:
-        if dr[2] not in county_dict:
-            county_dict[dr[2]] = {
-                dr[1]: {
-                    "Cases": int(dr[4]),
-                    "Deaths": int(dr[5])
-                }
-            }
-        elif dr[2] in county_dict:
-            county_dict[dr[2]].update(
-            {
-                dr[1]: {
-                    "Cases": int(dr[4]),
-                    "Deaths": int(dr[5])
-                }
-            }
-            )
+    if not result:
+        NEIGHBOR_INDEX.pop(level, None)
+        if os.path.exists(neighbor_index_filename(level)):
+            os.remove(neighbor_index_filename(level))
+        return None
 
-    return county_dict
+    raw = np.array([r[1:1 + len(ERS_METRICS)] for r in result], dtype=float)
+    std = np.nanstd(raw, axis=0)
+    std[(std == 0) | np.isnan(std)] = 1
 
-def clean_nums(data):
-    ''' Takes in a value and removes a comma in order to convert the value into an integer.
+    NEIGHBOR_INDEX[level] = {
+        "Names": np.array([r[0] for r in result]),
+        "Features": np.nan_to_num((raw - np.nanmean(raw, axis=0)) / std),
+        "Covid": np.array([r[1 + len(ERS_METRICS):] for r in result], dtype=np.int64)
+    }
+    np.savez(neighbor_index_filename(level), **NEIGHBOR_INDEX[level])
+
+    return NEIGHBOR_INDEX[level]
+
+def load_neighbor_index(level="state"):
+    ''' Returns the nearest-neighbor index for a level, loading it from its saved file if it is not already in NEIGHBOR_INDEX.
     
     PARAMETERS
     ----------
-    data: str
-        A value to be cleaned.
+    level: str
+        Either "state" or "county".
 
     RETURNS
     -------
-    int:
-        The value in integer form.
+    dict:
+        The index with keys "Names", "Features", "Covid", or None if it has not been built.
     '''
 
-    data = data.replace(',','')
-    return int(data)
-
-def income_to_int(values):
-    ''' Takes in a string of income data and removes both "$" and "," to produce a clean integer.
+    if level not in NEIGHBOR_INDEX:
+        try:
+            with np.load(neighbor_index_filename(level)) as saved:
+                NEIGHBOR_INDEX[level] = {key: saved[key] for key in saved.files}
+        except FileNotFoundError:
+            return None
+    return NEIGHBOR_INDEX[level]
+
+def find_similar_regions(name, k=5, level="state"):
+    ''' Finds the states (or counties) whose USDA ERS profiles are most like the given one, and returns them with their COVID-19 numbers side by side.
     
     PARAMETERS
     ----------
-    values: list
-        A list of income values to be cleaned.
+    name: str
+        The state (or county, as "County, State") to compare against.
+
+    k: int
+        The number of similar regions to return.
+
+    level: str
+        Either "state" or "county".
 
     RETURNS
     -------
     list:
-        A cleaned list of the income values in integer form.
+        Tuples of (name, distance, cases, deaths), closest first. The first tuple is the region itself. Empty if the name is not in the index.
     '''
 
-    list_of_values = []
+    index = load_neighbor_index(level)
+    if index is None:
+        return []
 
-    for v in values: 
-        v = v.replace("$",'')
-        v = v.replace(',','')
-        list_of_values.append(int(v))
+    matches = np.flatnonzero(index["Names"] == name)
+    if len(matches) == 0:
+        return []
 
-    return list_of_values
+    features = index["Features"]
+    distances = np.sqrt(((features - features[matches[0]]) ** 2).sum(axis=1))
 
-def convert_to_percent(values):
-    ''' Attempts to convert a list of values into a float in percentage format.
+    k = min(k + 1, len(distances))
+    nearest = np.argpartition(distances, k - 1)[:k]
+    nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+
+    return [(str(index["Names"][i]), float(distances[i]), int(index["Covid"][i][0]), int(index["Covid"][i][1])) for i in nearest]
+
+def read_geometry_file(filename):
+    ''' Reads a geometry file in the compact binary form used in GEO_DATA_DIR: NumPy arrays of FIPS codes, polygon, ring and coordinate offsets, and delta-encoded coordinates in 1/GEO_SCALE degrees.
     
     PARAMETERS
     ----------
-    values: list
-        A list of values to be converted into float percentage format.
+    filename: str
+        The .npz file to read.
 
     RETURNS
-    list:
-        The list of values where the value are either in float percentage format or their original form.
     -------
+    dict:
+        The arrays with keys "Fips", "PolygonOffsets", "RingOffsets", "CoordOffsets" and "Coords" (absolute integer coordinates).
     '''
 
-    list_of_values = []
-    
-    for v in values:
-        try:
-            percent = float('{0:.2f}'.format((v * 100)))
-            list_of_values.append(percent)
-        except:
-            list_of_values.append(v)
-    
-    return list_of_values
+    with np.load(filename) as saved:
+        geometry = {key: saved[key] for key in saved.files}
+    geometry["Coords"] = np.cumsum(geometry.pop("CoordDeltas"), axis=0, dtype=np.int32)
+    return geometry
 
-def write_to_json(filename, data):
-    ''' Takes in data and writes it out into JSON format.
+def write_geometry_file(filename, geometry):
+    ''' Writes geometry arrays to a compressed .npz file, delta-encoding the coordinates so they compress well.
     
     PARAMETERS
     ----------
     filename: str
-        The name of the JSON file to be created.
-    
-    data: dict
-        The data to be written into the JSON file.
+        The .npz file to write.
+
+    geometry: dict
+        Arrays in the form returned by read_geometry_file().
 
     RETURNS
     -------
     none
     '''
 
-    with open(filename, "w") as file_obj:
-        json.dump(data, file_obj, indent=4)
+    arrays = {key: value for key, value in geometry.items() if key != "Coords"}
+    arrays["CoordDeltas"] = np.diff(geometry["Coords"], axis=0, prepend=np.zeros((1, 2), dtype=np.int32))
+    np.savez_compressed(filename, **arrays)
 
-def clean_excel_data():
-    ''' Calls on various functions to access and clean XLSX data. Build dictionaries using XLSX data and then writes that data to JSON file.
+def simplify_geometry(geometry, tolerance):
+    ''' Simplifies geometry by snapping every point to a grid of the given size and dropping repeated points. Neighboring shapes snap their shared borders the same way, so no gaps open up between them. Rings left with fewer than 4 points are removed, and so are polygons whose outer ring is removed.
     
     PARAMETERS
     ----------
-    none
+    geometry: dict
+        Arrays in the form returned by read_geometry_file().
+
+    tolerance: float
+        The grid size in degrees.
 
     RETURNS
     -------
-    none
+    dict:
+        The simplified geometry in the same form.
     '''
 
-    # getting state socioeconomic data
-    comp_coll_names = get_excel_data("socioeconomic_data/EducationReportCompColl.xlsx", "EducationReport", 'A6:A56')
-    comp_coll_perc = get_excel_data("socioeconomic_data/EducationReportCompColl.xlsx", "EducationReport", 'F6:F56')
-
-    comp_hs_only_names = get_excel_data("socioeconomic_data/EducationReportHSOnly.xlsx", "EducationReport", 'A6:A56')
-    comp_hs_only = get_excel_data("socioeconomic_data/EducationReportHSOnly.xlsx", "EducationReport", 'F6:F56')
+    step = max(1, round(tolerance * GEO_SCALE))
+    coords = (np.round(geometry["Coords"] / step) * step).astype(np.int32)
+    polygon_offsets = geometry["PolygonOffsets"]
+    ring_offsets = geometry["RingOffsets"]
+    coord_offsets = geometry["CoordOffsets"]
+
+    changed = np.ones(len(coords), dtype=bool)
+    changed[1:] = (coords[1:] != coords[:-1]).any(axis=1)
+    changed[coord_offsets[:-1]] = True
+
+    fips = []
+    rings = []
+    new_polygon_offsets = [0]
+    new_ring_offsets = [0]
+    new_coord_offsets = [0]
+
+    for f in range(len(geometry["Fips"])):
+        for p in range(polygon_offsets[f], polygon_offsets[f + 1]):
+            for r in range(ring_offsets[p], ring_offsets[p + 1]):
+                ring = coords[coord_offsets[r]:coord_offsets[r + 1]][changed[coord_offsets[r]:coord_offsets[r + 1]]]
+                if len(ring) and (ring[0] != ring[-1]).any():
+                    ring = np.vstack([ring, ring[:1]])
+                if len(ring) < 4:
+                    if r == ring_offsets[p]:
+                        break
+                    continue
+                rings.append(ring)
+                new_coord_offsets.append(new_coord_offsets[-1] + len(ring))
+            if len(rings) > new_ring_offsets[-1]:
+                new_ring_offsets.append(len(rings))
+        if len(new_ring_offsets) - 1 > new_polygon_offsets[-1]:
+            new_polygon_offsets.append(len(new_ring_offsets) - 1)
+            fips.append(geometry["Fips"][f])
+
+    return {
+        "Fips": np.array(fips),
+        "PolygonOffsets": np.array(new_polygon_offsets, dtype=np.int32),
+        "RingOffsets": np.array(new_ring_offsets, dtype=np.int32),
+        "CoordOffsets": np.array(new_coord_offsets, dtype=np.int32),
+        "Coords": np.vstack(rings) if rings else np.empty((0, 2), dtype=np.int32)
+    }
+
+def geometry_to_geojson(geometry):
+    ''' Turns geometry arrays into a GeoJSON FeatureCollection of MultiPolygons, with each feature's FIPS code as its id.
+    
+    PARAMETERS
+    ----------
+    geometry: dict
+        Arrays in the form returned by read_geometry_file().
 
-    pop_names = get_excel_data("socioeconomic_data/PopulationReport.xlsx", "PopulationReport", 'A6:A56')
-    pop_num = get_excel_data("socioeconomic_data/PopulationReport.xlsx", "PopulationReport", 'E6:E56')
+    RETURNS
+    -------
+    dict:
+        The GeoJSON FeatureCollection.
+    '''
 
-    poverty_names = get_excel_data("socioeconomic_data/PovertyReportPercent.xlsx", "PovertyReport", 'A7:A57')
-    poverty_perc = get_excel_data("socioeconomic_data/PovertyReportPercent.xlsx", "PovertyReport", 'E7:E57')
+    coords = (geometry["Coords"] / GEO_SCALE).tolist()
+    polygon_offsets = geometry["PolygonOffsets"]
+    ring_offsets = geometry["RingOffsets"]
+    coord_offsets = geometry["CoordOffsets"]
 
-    unemp_names = get_excel_data("socioeconomic_data/UnemploymentReportPercent.xlsx", "UnemploymentReport", 'B4:B54')
-    unemp_perc = get_excel_data("socioeconomic_data/UnemploymentReportPercent.xlsx", "UnemploymentReport", 'K4:K54')
+    features = []
+    for f, fips in enumerate(geometry["Fips"]):
+        polygons = []
+        for p in range(polygon_offsets[f], polygon_offsets[f + 1]):
+            polygons.append([coords[coord_offsets[r]:coord_offsets[r + 1]] for r in range(ring_offsets[p], ring_offsets[p + 1])])
+        features.append({"type": "Feature", "id": str(fips), "geometry": {"type": "MultiPolygon", "coordinates": polygons}})
 
-    med_income_names = get_excel_data("socioeconomic_data/UnemploymentReportPercent.xlsx", "UnemploymentReport", 'B4:B54')
-    med_income = get_excel_data("socioeconomic_data/UnemploymentReportPercent.xlsx", "UnemploymentReport", 'L4:L54')
+    return {"type": "FeatureCollection", "features": features}
 
-    # building state socioeconomic dictionaries
-    comp_coll_dict = build_socioecon_dict(comp_coll_names, convert_to_percent(comp_coll_perc), "College Completion Rate")
-    comp_hs_only_dict = build_socioecon_dict(comp_hs_only_names, convert_to_percent(comp_hs_only), "Completed HS Only Rate")
-    poverty_dict = build_socioecon_dict(poverty_names, poverty_perc, "Poverty Rate")
-    pop_dict = build_socioecon_dict(pop_names, pop_num, "Population")
-    unemp_dict = build_socioecon_dict(unemp_names, unemp_perc, "Unemployment Rate")
-    med_income_dict = build_socioecon_dict(med_income_names, income_to_int(med_income), "Median Household Income")
+def load_geometry(kind, zoom=None):
+    ''' Returns the bundled "counties" or "states" geometry as GeoJSON, simplified for a zoom level in ZOOM_TOLERANCES. Each simplified version is built once, saved in GEO_CACHE_DIR and kept in GEOMETRY_CACHE.
     
-    usda_ers_data = build_usda_ers_dict(pop_dict, poverty_dict, comp_hs_only_dict, comp_coll_dict, unemp_dict, med_income_dict)
+    PARAMETERS
+    ----------
+    kind: str
+        Either "counties" or "states".
 
-    # writing data to json
-    write_to_json("USDA_ERS_Data.json", usda_ers_data)
+    zoom: str
+        A key of ZOOM_TOLERANCES, or None for the full bundled geometry.
 
-def access_state_sql_database(state):
-    ''' Makes a request to SQL database to access state-specific information on COVID-19 data and returns it as a list.
+    RETURNS
+    -------
+    dict:
+        The GeoJSON FeatureCollection.
+    '''
+
+    if (kind, zoom) in GEOMETRY_CACHE:
+        return GEOMETRY_CACHE[(kind, zoom)]
+
+    base_file = os.path.join(GEO_DATA_DIR, f"us_{kind}.npz")
+    if zoom is None:
+        geometry = read_geometry_file(base_file)
+    else:
+        cache_file = os.path.join(GEO_CACHE_DIR, f"us_{kind}_{zoom}.npz")
+        if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(base_file):
+            geometry = read_geometry_file(cache_file)
+        else:
+            geometry = simplify_geometry(read_geometry_file(base_file), ZOOM_TOLERANCES[zoom])
+            os.makedirs(GEO_CACHE_DIR, exist_ok=True)
+            write_geometry_file(cache_file, geometry)
+
+    GEOMETRY_CACHE[(kind, zoom)] = geometry_to_geojson(geometry)
+    return GEOMETRY_CACHE[(kind, zoom)]
+
+def access_choropleth_data(level, metric, state=None):
+    ''' Makes a request to SQL database for the value of a metric in every state or county, keyed by FIPS code. State values come from the latest day of the "CovidStateDaily" rollup table, with each state's FIPS code taken from the first two digits of its county codes in "CountyRanks"; county values come from the "CountyRanks" table.
     
     PARAMETERS
     ----------
+    level: str
+        Either "state" or "county".
+
+    metric: str
+        "Cases", "Deaths", "Cases Per 100k" or "Deaths Per 100k". Counties also accept "Growth", and only have per-capita values when the "SocioeconomicCounties" table has county populations.
+
     state: str
-        The state for which the user would like to see data on.
+        If given, only counties in this state are returned.
 
     RETURNS
     -------
     list:
-        The results of the SQL query.
+        (Fips, Name, Value) tuples, with Fips as a zero-padded string. The NYT reports New York City as one area without a FIPS code, so its value is repeated for each of the counties in FIPS_BOROUGHS.
     '''
 
     conn = sqlite3.connect(DB_NAME)
     cur = conn.cursor()
-    query = f'''
-        SELECT StateName, County, MAX(CountyCases), MAX(CountyDeaths)
-        FROM CovidCounty
-        WHERE StateName = "{state}"
-        GROUP BY County
-        ORDER BY MAX(CountyCases) DESC
-    '''
-    result = cur.execute(query).fetchall()
+    if level == "state":
+        value = {
+            "Cases": "sd.StateCases",
+            "Deaths": "sd.StateDeaths",
+            "Cases Per 100k": "sd.StateCases * 100000.0 / ss.StatePopulation",
+            "Deaths Per 100k": "sd.StateDeaths * 100000.0 / ss.StatePopulation"
+        }[metric]
+        query = f'''
+            SELECT sf.Fips, sd.StateName, {value}
+            FROM CovidStateDaily as sd
+                LEFT JOIN SocioeconomicStates as ss
+                ON sd.StateName = ss.StateName
+                LEFT JOIN (SELECT StateName, MIN(Fips / 1000) as Fips FROM CountyRanks WHERE Metric = 'Cases' AND Fips IS NOT NULL GROUP BY StateName) as sf
+                ON sd.StateName = sf.StateName
+            WHERE sd.Date = (SELECT MAX(Date) FROM CovidStateDaily)
+        '''
+        result = [(f"{r[0]:02d}", r[1], r[2]) for r in cur.execute(query).fetchall() if r[0] is not None]
+    else:
+        query = '''
+            SELECT Fips, County, StateName, Value
+            FROM CountyRanks
+            WHERE Metric = ? AND (? IS NULL OR StateName = ?)
+        '''
+        result = []
+        for fips, county, state_name, value in cur.execute(query, [metric, state, state]).fetchall():
+            if fips is not None:
+                result.append((f"{fips:05d}", county, value))
+            for borough in FIPS_BOROUGHS.get((state_name, county), []):
+                result.append((f"{borough:05d}", f"{county} (all boroughs)", value))
     conn.close()
     return result
 
-def access_national_sql_database():
-    ''' Makes a request to SQL database to access state information on COVID-19 data, USDA ERS socioeconomic data for each state, and returns it as a list.
+def create_choropleth(level="state", metric="Cases", state=None):
+    ''' Using Plotly, creates a choropleth map of a metric for every state, every county, or the counties of one state. The map uses the bundled geometry, simplified for the zoom level, so it builds without a network connection.
     
     PARAMETERS
     ----------
-    none
+    level: str
+        Either "state" or "county".
+
+    metric: str
+        The metric to color by. See access_choropleth_data().
+
+    state: str
+        If given with level "county", the map is zoomed to this state.
 
     RETURNS
     -------
-    list:
-        The results of the SQL query.
+    plotly.graph_objs.Figure:
+        The choropleth map.
     '''
 
-    conn = sqlite3.connect(DB_NAME)
-    cur = conn.cursor()
-    query = '''
-        SELECT Name, MAX(StateCases), MAX(StateDeaths), ss.StatePopulation, ss.StateMedianIncome, ss.StateUnemploymentRate, ss.StatePovertyRate, ss.StateCompCollRate, ss.StateCompHSOnlyRate
-        FROM CovidState
-            JOIN SocioeconomicStates as ss
-            ON CovidState.Name = ss.StateName
-        GROUP BY Name
-        ORDER BY MAX(StateCases) DESC
+    data = access_choropleth_data(level, metric, state)
+    geojson = load_geometry("states" if level == "state" else "counties", "state" if state else "nation")
+
+    if state:
+        locations = {d[0] for d in data}
+        geojson = {"type": "FeatureCollection", "features": [f for f in geojson["features"] if f["id"] in locations]}
+
+    fig = go.Figure(go.Choropleth(
+        geojson=geojson,
+        locations=[d[0] for d in data],
+        z=[d[2] for d in data],
+        text=[d[1] for d in data],
+        colorscale="Reds",
+        marker_line_width=0.3,
+        colorbar_title=metric
+    ))
+
+    if state:
+        fig.update_geos(fitbounds="locations", visible=False)
+        fig.update_layout(title=f"{state} 2020 COVID-19 {metric} by County")
+    else:
+        fig.update_geos(scope="usa", visible=False)
+        fig.update_layout(title=f"National 2020 COVID-19 {metric} by {level.capitalize()}")
+
+    fig.layout.margin.update({"t":75, "l":50})
+    return fig
+
+def benchmark_choropleth(metric="Cases"):
+    ''' Compares building the national county choropleth from the cached, simplified geometry against an unsimplified GeoJSON baseline, and prints the results. The baseline is the full bundled geometry written out as GeoJSON text, which is parsed on every build.
+    
+    PARAMETERS
+    ----------
+    metric: str
+        The metric to map.
+
+    RETURNS
+    -------
+    dict:
+        Build seconds and payload bytes for each version.
+        Example:
+            {"GeoJSON": {"Build": FLOAT, "Payload": INT}, "Simplified": {"Build": FLOAT, "Payload": INT}}
     '''
-    result = cur.execute(query).fetchall()
-    conn.close()
-    return result
+
+    baseline_text = json.dumps(geometry_to_geojson(read_geometry_file(os.path.join(GEO_DATA_DIR, "us_counties.npz"))))
+    data = access_choropleth_data("county", metric)
+
+    results = {}
+    for version in ["GeoJSON", "Simplified"]:
+        start = time.perf_counter()
+        if version == "GeoJSON":
+            geojson = json.loads(baseline_text)
+        else:
+            geojson = load_geometry("counties", "nation")
+        fig = go.Figure(go.Choropleth(geojson=geojson, locations=[d[0] for d in data], z=[d[2] for d in data]))
+        payload = fig.to_json()
+        results[version] = {"Build": time.perf_counter() - start, "Payload": len(payload)}
+        print(f"{version}: Build - {results[version]['Build']:.3f}s | Payload - {results[version]['Payload'] / 1000000:.2f}MB")
+
+    return results
+
+def create_distribution_figure(state=None):
+    ''' Using Plotly, creates a bar graph of how county cases and deaths are distributed in a state or the nation, from the precomputed quantile sketches. The median, 90th and 99th percentiles and maximum are shown in the legend.
+    
+    PARAMETERS
+    ----------
+    state: str
+        The state to summarize. None summarizes the nation.
+
+    RETURNS
+    -------
+    plotly.graph_objs.Figure:
+        The bar graph.
+    '''
+
+    fig = go.Figure()
+    for metric in ["Cases", "Deaths"]:
+        summary = access_distribution_summary(metric, state)
+        if not summary["Count"]:
+            continue
+        labels = [f"{low:,}-{high:,}" for low, high, count in summary["Histogram"]]
+        counts = [count for low, high, count in summary["Histogram"]]
+        name = f"{metric} (Median {summary['Median']:.0f}, P90 {summary['P90']:.0f}, P99 {summary['P99']:.0f}, Max {summary['Max']:.0f})"
+        fig.add_trace(go.Bar(name=name, x=labels, y=counts))
+
+    fig.update_layout(
+        title=f"{state or 'National'} 2020 COVID-19 Distribution by County",
+        xaxis_title="Count Per County",
+        yaxis_title="Number of Counties"
+    )
+    return fig
 
 def create_and_show_figures(user_input):
-    ''' Using Plotly, creates a bar graph and a table based on user_input value. Launches the visuals in the user's browser.
+    ''' Using Plotly, creates a bar graph and a table based on user_input value, plus a county distribution summary. Launches the visuals in the user's browser.
     
     PARAMETERS
     ----------
@@ -685,6 +2809,7 @@ def create_and_show_figures(user_input):
     print("\nThe visuals will now launch in your browswer.")
     time.sleep(2)
     table.show()
+    create_distribution_figure(None if user_input == "nation" else user_input).show()
 
 def open_cache():
     ''' Opens the cache file if it exists and loads the JSON into
@@ -762,7 +2887,9 @@ if __name__ == "__main__":
     clean_excel_data()
     create_database()
     populate_database()
-    write_to_json("US_Covid.json", npr_covid_data_dict())
+    start_background_refresh()
+    time_pulled, snapshot = access_state_snapshot()
+    write_to_json("US_Covid.json", {name: {"Cases": cases, "Deaths": deaths} for name, cases, deaths in snapshot})
     write_to_json("County_Covid.json", clean_county_covid_data())
 
     welcome_message = '''
@@ -796,7 +2923,12 @@ if __name__ == "__main__":
     while True:
         while change is True:
             counter = 1
-            for k,v in build_county_url_dict().items():
+            try:
+                datasets = build_county_url_dict()
+            except requests.exceptions.RequestException:
+                datasets = {}
+                print("The USDA ERS dataset list could not be loaded right now.")
+            for k,v in datasets.items():
                 print(f"[{counter}] {k}")
                 URL_LIST.append(v)
                 counter += 1
@@ -809,7 +2941,7 @@ if __name__ == "__main__":
 
             elif webpage.isnumeric():
                 webpage_num = int(webpage)
-                if 1 <= webpage_num <= 4:
+                if 1 <= webpage_num <= 4 and URL_LIST:
                     for i in range(len(URL_LIST)):
                         webbrowser.open((URL_LIST[webpage_num - 1]))
                 else:
@@ -819,7 +2951,7 @@ if __name__ == "__main__":
                 switch = True
                 while switch is True:
                     time.sleep(1)
-                    covid_data = input("\nYou can see COVID-19 data for the entire nation or a specific state. Enter 'nation', 'state', 'back' to go back and view USDA ERS data, or 'exit'.\n")
+                    covid_data = input("\nYou can see COVID-19 data for the entire nation or a specific state. Enter 'nation', 'state', 'top' to see the top 10 counties, 'map' to see COVID-19 maps, 'back' to go back and view USDA ERS data, or 'exit'.\n")
 
                     if covid_data.lower() == "exit":
                         exit()
@@ -829,9 +2961,10 @@ if __name__ == "__main__":
                         change = True
 
                     elif covid_data.lower() == "nation":
-                        print(f"\nThis data is accurate as of {npr_covid_data_time_pulled()}.\n")
-                        for k,v in npr_covid_data_dict().items():
-                            print(f"{k}: Cases - {v['Cases']} | Deaths - {v['Deaths']}")
+                        time_pulled, snapshot = access_state_snapshot()
+                        print(f"\nThis data is accurate as of {time_pulled}.\n")
+                        for name, cases, deaths in snapshot:
+                            print(f"{name}: Cases - {cases} | Deaths - {deaths}")
                             time.sleep(.3)
 
                         visuals = input("\nThis data can be presented visually. The COVID-19 data will be presented in both bar graph and table form. The socioeconimc data will be presented in table form only. Would you like to see it? Enter 'yes', 'back', or 'exit'.\n")
@@ -861,6 +2994,19 @@ if __name__ == "__main__":
                         else:
                             print("Not a valid entry. Try again.\n")
                     
+                    elif covid_data.lower() == "map":
+                        print("\nThe maps will now launch in your browser.")
+                        time.sleep(2)
+                        create_choropleth("state", "Cases Per 100k").show()
+                        create_choropleth("county", "Cases").show()
+
+                    elif covid_data.lower() == "top":
+                        for metric in ["Cases", "Deaths", "Growth"]:
+                            print(f"\nTop 10 counties by {metric.lower()}:")
+                            for rank, county, state, value in access_top_counties(metric, 10):
+                                print(f"[{rank}] {county}, {state}: {value}")
+                                time.sleep(.3)
+
                     elif covid_data.lower() == "state":
                         turn = True
                         while turn is True:
@@ -887,8 +3033,13 @@ if __name__ == "__main__":
                                     for i in range(len(STATES)):
                                         print(f"\nHere is the data for {STATES[STATE_INPUT_NUM - 1]}. It is accurate as of April 26th.\n")
                                         time.sleep(1)
-                                        for data in access_state_sql_database(STATES[STATE_INPUT_NUM - 1]):
-                                            print(f"{data[1]}: Cases - {data[2]} | Deaths - {data[3]}")
+                                        for metric in ["Cases", "Deaths"]:
+                                            summary = access_distribution_summary(metric, STATES[STATE_INPUT_NUM - 1])
+                                            print(f"County {metric.lower()} across {summary['Count']} counties: Median - {summary['Median']:.0f} | 90th Percentile - {summary['P90']:.0f} | 99th Percentile - {summary['P99']:.0f} | Max - {summary['Max']:.0f}")
+                                            time.sleep(.3)
+                                        print("\nTop 10 counties by cases:")
+                                        for rank, county, state, value in access_top_counties("Cases", 10, STATES[STATE_INPUT_NUM - 1]):
+                                            print(f"[{rank}] {county}: {value}")
                                             time.sleep(.3)
                                         break
                                     